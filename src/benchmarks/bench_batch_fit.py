@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+""" Check and benchmark fitting many spectra at once with ``batch_minimiser``.
+
+Generates noisy spectra over a range of σ and κ and fits them all with
+``SpectrumFitterBuilder.batch_minimiser``, then fits a subset one at a time with
+``minimiser`` and ``profile_minimiser``. The batch fit should reproduce
+``profile_minimiser``, which it vectorises, to the given relative tolerance. It is
+compared with ``minimiser`` by the fitting error, as ``least_squares`` can stop in a
+different local minimum along the flat valleys of the error. The script exits with a
+non-zero status if the batch fit doesn't match ``profile_minimiser``.
+
+Usage
+-----
+
+    python bench_batch_fit.py [--n-spectra 5000] [--n-reference 300] [--rtol 1e-4]
+
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from flickerprint.fluctuation.spectra import SpectrumFitterBuilder
+
+KEYS = ["sigma_bar", "sigma_bar_err", "kappa_scale", "kappa_scale_err", "fitting_error"]
+
+
+def simulate_spectra(builder, n_spectra, noise, rng):
+    """ Spectra with σ between 10^-2 and 10^4, κ between 10^-4 and 10^2 and log-normal noise. """
+    sigma_bar = 10 ** rng.uniform(-2, 4, n_spectra)
+    kappa_bar = 10 ** rng.uniform(-4, 2, n_spectra)
+    spectra = builder.get_spectra(sigma_bar[:, None], kappa_bar[:, None])[:, 0]
+    return spectra * 10 ** rng.normal(0, noise, spectra.shape)
+
+
+def relative_difference(new, old):
+    """ Relative difference, taking two zeros as equal. """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(new == old, 0.0, np.abs(new - old) / np.abs(old))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-spectra", type=int, default=5000)
+    parser.add_argument("--n-reference", type=int, default=300, help="Number of spectra to fit one at a time")
+    parser.add_argument("--noise", type=float, default=0.1, help="Standard deviation of the noise in log10")
+    parser.add_argument("--q-max", type=int, default=15)
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    builder = SpectrumFitterBuilder(q_max=args.q_max)
+    spectra = simulate_spectra(builder, args.n_spectra, args.noise, np.random.default_rng(args.seed))
+    reference_spectra = spectra[:args.n_reference]
+
+    start = time.perf_counter()
+    batch = builder.batch_minimiser(spectra)
+    batch_rate = args.n_spectra / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    profile = [builder.profile_minimiser(spectrum) for spectrum in reference_spectra]
+    profile_rate = args.n_reference / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    least_squares = []
+    for spectrum in reference_spectra:
+        try:
+            least_squares.append(builder.minimiser(*builder.create_fitting_function(spectrum)))
+        except ValueError:
+            least_squares.append(None)
+    least_squares_rate = args.n_reference / (time.perf_counter() - start)
+
+    print(f"{'method':>18} {'fits/s':>10}")
+    for name, rate in [("batch_minimiser", batch_rate), ("profile_minimiser", profile_rate), ("minimiser", least_squares_rate)]:
+        print(f"{name:>18} {rate:10.1f}")
+
+    passed = True
+    print(f"\nCompared with profile_minimiser\n{'value':>16} {'max rel. diff':>14}")
+    for key in KEYS:
+        difference = relative_difference(batch[key][:args.n_reference], np.array([result[key] for result in profile]))
+        passed &= bool(difference.max() <= args.rtol)
+        print(f"{key:>16} {difference.max():14.2e}")
+
+    fitted = [index for index, result in enumerate(least_squares) if result is not None]
+    batch_error = batch["fitting_error"][fitted]
+    least_squares_error = np.array([least_squares[index]["fitting_error"] for index in fitted])
+    matching = relative_difference(batch_error, least_squares_error) <= args.rtol
+    print("\nCompared with minimiser")
+    print(f"  same fitting error for {matching.mean():.1%} of the spectra")
+    print(f"  better fit for {np.mean(~matching & (batch_error < least_squares_error)):.1%}")
+    print(f"  worse fit for {np.mean(~matching & (batch_error > least_squares_error)):.1%}")
+    print(f"  minimiser failed for {len(reference_spectra) - len(fitted)}")
+    for key in ["sigma_bar", "kappa_scale"]:
+        difference = relative_difference(batch[key][fitted], np.array([least_squares[index][key] for index in fitted]))
+        print(f"  {key} within rtol for {np.mean(difference[matching] <= args.rtol):.1%} of those with the same error")
+
+    print(f"\n{'PASSED' if passed else 'FAILED'} with rtol={args.rtol}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
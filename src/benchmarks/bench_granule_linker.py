@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+""" Benchmark of linking granules between frames.
+
+Simulates ``n`` granules diffusing across a frame, with some granules disappearing
+and new granules appearing in each frame, and times ``_GranuleLinker.link_granules``.
+For the smaller sizes the labels are checked against, and timed against, the original
+linker, which built the full distance matrix and repeatedly searched it for the
+closest pair.
+
+Usage
+-----
+
+    python bench_granule_linker.py [--sizes 1000 3000 10000] [--frames 10] [--reference-limit 1000]
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from flickerprint.common.boundary_extraction import _GranuleLinker
+
+
+class ReferenceLinker:
+    """ The original linker, using a dense distance matrix. """
+
+    def __init__(self, memory=3, max_distance=15):
+        self._stored_positions = None
+        self._stored_labels = None
+        self._memory_counter = {}
+        self.max_id = 0
+        self.memory = memory
+        self.max_distance = max_distance
+        self._init = True
+
+    def link_granules(self, positions):
+        if self._init:
+            self._stored_positions = positions.copy()
+            self._stored_labels = np.arange(len(positions), dtype=int)
+            self.max_id = len(positions) - 1
+            self._init = False
+            return np.arange(len(positions), dtype=int)
+
+        n_granules = len(positions)
+        n_stored = len(self._stored_positions)
+        labels = np.zeros(n_granules, dtype=int)
+        handled_granules = np.full(len(positions), False)
+        handled_stored = np.full(len(self._stored_positions), False)
+        distances = cdist(positions, self._stored_positions)
+
+        for i in range(min(n_granules, n_stored)):
+            new_index, old_index = np.unravel_index(np.nanargmin(distances, axis=None), distances.shape)
+            if self.max_distance is not None and distances[new_index, old_index] > self.max_distance:
+                break
+            labels[new_index] = self._stored_labels[old_index]
+            self._stored_positions[old_index] = positions[new_index]
+            handled_granules[new_index] = True
+            handled_stored[old_index] = True
+            distances[new_index, :] = np.nan
+            distances[:, old_index] = np.nan
+
+        unhandled = [positions[i] for i, x in enumerate(handled_granules) if not x]
+        if unhandled:
+            tail_labels = np.arange(self.max_id + 1, self.max_id + 1 + len(unhandled))
+            labels[~handled_granules] = tail_labels
+            self._stored_labels = np.append(self._stored_labels, tail_labels)
+            self._stored_positions = np.append(self._stored_positions, unhandled, axis=0)
+            self.max_id += len(unhandled)
+
+        missing = [i for i, x in enumerate(handled_stored) if not x]
+        missing_ids = [self._stored_labels[i] for i in missing]
+        for granule_id in [g for g in self._memory_counter if g not in missing_ids]:
+            del self._memory_counter[granule_id]
+        for_removal = []
+        for granule_id, index in zip(missing_ids, missing):
+            if granule_id in self._memory_counter:
+                if self._memory_counter[granule_id] == 1:
+                    del self._memory_counter[granule_id]
+                    for_removal.append(index)
+                else:
+                    self._memory_counter[granule_id] -= 1
+            else:
+                self._memory_counter[granule_id] = self.memory
+
+        self._stored_positions = np.delete(self._stored_positions, for_removal, axis=0)
+        self._stored_labels = np.delete(self._stored_labels, for_removal)
+        return labels
+
+
+def simulate_frames(n_granules, n_frames, rng, step=2.0, turnover=0.05):
+    """ Positions of diffusing granules, with a fraction replaced in each frame. """
+    # Keep the density similar to a crowded microscope frame
+    size = np.sqrt(n_granules) * 40
+    positions = rng.uniform(0, size, (n_granules, 2))
+    frames = []
+    for _ in range(n_frames):
+        positions = positions + rng.normal(0, step, positions.shape)
+        replaced = rng.random(n_granules) < turnover
+        positions[replaced] = rng.uniform(0, size, (replaced.sum(), 2))
+        # Some granules are not detected in each frame
+        detected = rng.random(n_granules) > turnover
+        frames.append(positions[detected].copy())
+    return frames
+
+
+def time_linker(linker, frames):
+    labels = []
+    start = time.perf_counter()
+    for positions in frames:
+        labels.append(linker.link_granules(positions.copy()))
+    return time.perf_counter() - start, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 3000, 10000])
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--reference-limit", type=int, default=1000, help="Largest size to run the original linker on")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'granules':>10} {'linker':>12} {'reference':>12}  (seconds per frame)")
+    for n_granules in args.sizes:
+        frames = simulate_frames(n_granules, args.frames, rng)
+        linker_time, labels = time_linker(_GranuleLinker(memory=10, max_distance=15), frames)
+
+        reference = "-"
+        if n_granules <= args.reference_limit:
+            reference_time, reference_labels = time_linker(ReferenceLinker(memory=10, max_distance=15), frames)
+            for new, old in zip(labels, reference_labels):
+                np.testing.assert_array_equal(new, old)
+            reference = f"{reference_time / args.frames:12.4f}"
+        print(f"{n_granules:>10} {linker_time / args.frames:12.4f} {reference:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+""" Benchmark the compression codecs for the HDF5 output files.
+
+Reads the Fourier terms from existing ``fourier.h5`` files and, for each codec, times
+writing them as the appendable table used by ``process-image`` and as the fixed format
+used for ``aggregate_fittings.h5``, then times reading them back with ``pd.read_hdf``
+as ``load_fourier_terms`` does. The table is written in the layout of the input files,
+either ``granules`` (a row per granule and frame) or the older long ``fourier`` table.
+
+Usage
+-----
+
+    python bench_hdf_compression.py EXPERIMENT_DIR/fourier/*.h5 [--levels 1 5 9]
+
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+import pandas as pd
+
+from flickerprint.common.utilities import HDF_COMPRESSION
+
+
+def read_fourier_table(fourier_path: Path):
+    """ Return the key and the table stored in a Fourier file. """
+    with h5py.File(fourier_path, "r") as f:
+        key = "granules" if "granules" in f else "fourier"
+    return key, pd.read_hdf(fourier_path, key=key, mode="r")
+
+
+def time_codec(fourier_terms, save_path, complib, complevel, table_format, chunk_rows):
+    """ Return the write time, read time and file size for one codec. """
+    compression = dict(complib=complib, complevel=complevel if complib else 0)
+
+    start = time.perf_counter()
+    if table_format:
+        # Written in chunks, as process-image appends each frame
+        with pd.HDFStore(save_path, mode="w", **compression) as store:
+            for chunk_start in range(0, len(fourier_terms), chunk_rows):
+                chunk = fourier_terms.iloc[chunk_start : chunk_start + chunk_rows]
+                store.append("fourier", chunk, format="table", index=False, min_itemsize={"timestamp": 40})
+    else:
+        fourier_terms.to_hdf(save_path, key="fourier", mode="w", **compression)
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    read_back = pd.read_hdf(save_path, key="fourier", mode="r")
+    read_time = time.perf_counter() - start
+    assert len(read_back) == len(fourier_terms)
+
+    return write_time, read_time, save_path.stat().st_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fourier_files", type=Path, nargs="+")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 9])
+    parser.add_argument("--chunk-rows", type=int, default=20, help="Rows per append, about one frame of granules")
+    args = parser.parse_args()
+
+    keys, tables = zip(*[read_fourier_table(path) for path in args.fourier_files])
+    if len(set(keys)) > 1:
+        raise ValueError("The Fourier files must all have the same layout.")
+    fourier_terms = pd.concat(tables, ignore_index=True)
+    mb = fourier_terms.memory_usage(deep=True).sum() / 1e6
+    print(f"{len(fourier_terms)} rows in the {keys[0]} layout, {mb:.1f} MB in memory\n")
+
+    print(f"{'format':>7} {'codec':>6} {'level':>5} {'write MB/s':>11} {'read MB/s':>10} {'size MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_path = Path(tmp_dir) / "fourier.h5"
+        for table_format in (True, False):
+            for name, complib in HDF_COMPRESSION.items():
+                for level in args.levels if complib else [0]:
+                    write_time, read_time, size = time_codec(
+                        fourier_terms, save_path, complib, level, table_format, args.chunk_rows
+                    )
+                    print(
+                        f"{'table' if table_format else 'fixed':>7} {name:>6} {level:>5} "
+                        f"{mb / write_time:11.1f} {mb / read_time:10.1f} {size / 1e6:8.2f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
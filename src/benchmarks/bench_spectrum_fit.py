@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+""" Benchmark of fitting σ and κ to flicker spectra.
+
+Generates noisy spectra over a range of σ and κ and fits each of them with
+``SpectrumFitterBuilder.minimiser``, once with the Jacobian estimated by finite
+differences, the default, and once with the analytic ``residual_jacobian``. The
+analytic Jacobian is first checked against finite differences at a few points, and the
+fitted values of the two runs are compared. The speed up varies between machines, as
+most of the time is spent in ``least_squares`` itself.
+
+Usage
+-----
+
+    python bench_spectrum_fit.py [--n-spectra 200] [--noise 0.1] [--q-max 15]
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.optimize._numdiff import approx_derivative
+
+from flickerprint.fluctuation.spectra import SpectrumFitterBuilder
+
+
+def simulate_spectra(builder, n_spectra, noise, rng):
+    """ Spectra with σ between 10^-2 and 10^4, κ between 10^-4 and 10^2 and log-normal noise. """
+    sigma_bar = 10 ** rng.uniform(-2, 4, n_spectra)
+    kappa_bar = 10 ** rng.uniform(-4, 2, n_spectra)
+    spectra = builder.get_spectra(sigma_bar[:, None], kappa_bar[:, None])[:, 0]
+    return spectra * 10 ** rng.normal(0, noise, spectra.shape)
+
+
+def check_jacobian(builder, spectrum, rng, n_points=20):
+    """ Largest relative difference between the analytic and finite difference Jacobians. """
+    residuals, _ = builder.create_fitting_function(spectrum)
+    worst = 0.0
+    for _ in range(n_points):
+        params = np.array([10 ** rng.uniform(-2, 4), 10 ** rng.uniform(-4, 2)])
+        # A relative step, as the default step is absolute for parameters below one
+        numeric = approx_derivative(residuals, params, method="3-point", abs_step=params * 1e-6)
+        analytic = builder.residual_jacobian(*params)
+        worst = max(worst, np.max(np.abs(analytic - numeric) / np.abs(numeric)))
+    return worst
+
+
+def fit(builder, spectrum, analytic_jacobian):
+    """ Fit a single spectrum, returning None if ``least_squares`` fails. """
+    try:
+        return builder.minimiser(*builder.create_fitting_function(spectrum), analytic_jacobian=analytic_jacobian)
+    except ValueError:
+        return None
+
+
+def time_fits(builder, spectra, analytic_jacobian):
+    start = time.perf_counter()
+    results = [fit(builder, spectrum, analytic_jacobian) for spectrum in spectra]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-spectra", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.1, help="Standard deviation of the noise in log10")
+    parser.add_argument("--q-max", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    builder = SpectrumFitterBuilder(q_max=args.q_max)
+    spectra = simulate_spectra(builder, args.n_spectra, args.noise, rng)
+    print(f"Jacobian max rel. diff from finite differences: {check_jacobian(builder, spectra[0], rng):.2e}\n")
+
+    numeric_time, numeric = time_fits(builder, spectra, analytic_jacobian=False)
+    analytic_time, analytic = time_fits(builder, spectra, analytic_jacobian=True)
+
+    print(f"{'jacobian':>10} {'fits/s':>10} {'failed':>8}")
+    for name, duration, results in [("numeric", numeric_time, numeric), ("analytic", analytic_time, analytic)]:
+        print(f"{name:>10} {args.n_spectra / duration:10.1f} {sum(result is None for result in results):8d}")
+
+    # Only compare the spectra that both fitted
+    both = [(new, old) for new, old in zip(analytic, numeric) if new is not None and old is not None]
+    analytic, numeric = zip(*both)
+    print(f"\n{'value':>16} {'median rel. diff':>17} {'max rel. diff':>14}")
+    for key in ["sigma_bar", "kappa_scale", "sigma_bar_err", "kappa_scale_err", "fitting_error"]:
+        new = np.array([result[key] for result in analytic])
+        old = np.array([result[key] for result in numeric])
+        difference = np.abs(new - old) / np.abs(old)
+        print(f"{key:>16} {np.median(difference):17.2e} {difference.max():14.2e}")
+
+    analytic_error = np.array([result["fitting_error"] for result in analytic])
+    numeric_error = np.array([result["fitting_error"] for result in numeric])
+    print(f"\nAnalytic fit is better or equal for {np.mean(analytic_error <= numeric_error * (1 + 1e-8)):.1%} of the fitted spectra")
+    print(f"Largest increase in fitting error with the analytic Jacobian: {np.max(analytic_error / numeric_error - 1):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+""" Check and benchmark the exact surface tension only fit.
+
+Generates noisy surface tension only spectra over a wide range of σ and fits them with
+``SpectrumFitterBuilder_ST_Only.exact_fit``, all at once, and with the numerical
+``minimiser``, one spectrum at a time. The fitted values are compared and the script
+exits with a non-zero status if any differ by more than the given relative tolerance.
+The numerical fit stops within about 1e-8 of the exact σ, so this limits the agreement.
+
+Usage
+-----
+
+    python bench_st_only_fit.py [--n-spectra 500] [--noise 0.3] [--rtol 1e-4]
+
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from flickerprint.fluctuation.spectra import SpectrumFitterBuilder_ST_Only
+
+
+def simulate_spectra(builder, n_spectra, noise, rng):
+    """ Spectra with σ between 10^-3 and 10^5 and log-normal noise on each mode. """
+    sigma_bar = 10 ** rng.uniform(-3, 5, n_spectra)
+    spectra = builder.get_spectra(sigma_bar[:, None, None])
+    return spectra * 10 ** rng.normal(0, noise, spectra.shape)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n-spectra", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.3, help="Standard deviation of the noise in log10")
+    parser.add_argument("--q-max", type=int, default=15)
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    builder = SpectrumFitterBuilder_ST_Only(q_max=args.q_max)
+    spectra = simulate_spectra(builder, args.n_spectra, args.noise, np.random.default_rng(args.seed))
+
+    start = time.perf_counter()
+    exact = builder.exact_fit(spectra)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    numeric = [builder.minimiser(*builder.create_fitting_function(spectrum)) for spectrum in spectra]
+    numeric_time = time.perf_counter() - start
+
+    passed = True
+    print(f"{'value':>18} {'max rel. diff':>14}")
+    for key in ["sigma_ST_bar", "sigma_ST_bar_err", "fitting_error_ST"]:
+        numeric_values = np.array([result[key] for result in numeric])
+        difference = np.abs(exact[key] - numeric_values) / np.abs(numeric_values)
+        passed &= bool(difference.max() <= args.rtol)
+        print(f"{key:>18} {difference.max():14.2e}")
+    # The exact solution is the global minimum, so should never be a worse fit
+    worse = np.array([result["fitting_error_ST"] for result in numeric]) < exact["fitting_error_ST"] * (1 - args.rtol)
+    passed &= not worse.any()
+
+    print(f"\n{'exact':>10} {exact_time / args.n_spectra * 1e6:10.2f} µs per spectrum")
+    print(f"{'numeric':>10} {numeric_time / args.n_spectra * 1e6:10.2f} µs per spectrum")
+    print(f"\n{'PASSED' if passed else 'FAILED'} with rtol={args.rtol}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,12 @@ Provides
 BoundaryExtractionGradient(granule:Granule):
     A class for measuring the boundary of the granules.
 
+FourierRecordBuffer:
+    Columnar store of the Fourier terms for each granule, used to build the table.
+
+FrameBoundaryExtraction(granules:Iterable[Granule]):
+    Measure the boundaries of all of the granules in a frame together.
+
 
 """
 
@@ -39,7 +45,7 @@ from typing import Iterable
 import numpy as np
 import pandas as pd
 import scipy.ndimage as ndi
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 
 import flickerprint.tools.plot_tools as pt
 from flickerprint.common import kernels
@@ -57,6 +63,8 @@ class BoundaryExtraction:
         self.angles = None
         self.radii = None
         self.processed_image = None
+        # Spline coefficients of the processed image, keyed by the interpolation order
+        self._spline_coefficients = {}
 
         if boundary_method == "gradient":
             self.imageProcessor = _BoundaryExtractionGradient(granule)
@@ -85,8 +93,8 @@ class BoundaryExtraction:
         return self.radii.mean()
 
     @staticmethod
-    def get_fourier_terms(radii):
-        """ Perform the Fourier analysis.
+    def get_fourier_terms(radii, max_order: int = 59):
+        """ Perform the Fourier analysis, keeping the modes from 2 up to ``max_order``.
 
         Returns
         -------
@@ -116,7 +124,7 @@ class BoundaryExtraction:
         components = np.fft.rfft(perturbation)
         components *= 1.0 / n_theta
 
-        fourier_limit = 60
+        fourier_limit = max_order + 1
         fft_freq = np.fft.rfftfreq(n_theta, 1.0 / n_theta)
         return components[2:fourier_limit], fft_freq[2:fourier_limit], components[1]
 
@@ -151,6 +159,9 @@ class BoundaryExtraction:
         the radius that best corresponds to the boundary. This evenly spaced nature
         allows us to Fourier transform the results.
 
+        All of the rays are sampled in a single interpolation call, as this is the
+        innermost loop of the image processing.
+
         Parameters
         ----------
 
@@ -174,21 +185,18 @@ class BoundaryExtraction:
             self.processed_image = self.imageProcessor.process_image()
 
         angles = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
-        radii = np.zeros_like(angles)
-
-        for num, angle in enumerate(angles):
-            sample_length = self.granule.crop_width
-            sample_count = int(sample_length) * samples_per_pixel
-
-            sample = self._sample_at_angle(
-                angle=angle,
-                sample_length=sample_length,
-                sample_count=sample_count,
-                im=self.processed_image,
-                order=order,
-            )
-            peak_location = self._get_peak_location(sample)
-            radii[num] = peak_location
+        sample_length = self.granule.crop_width
+        sample_count = int(sample_length) * samples_per_pixel
+
+        # Sample along every ray at once, giving an (n_angles, sample_count) array
+        samples = self._sample_at_angle(
+            angle=angles,
+            sample_length=sample_length,
+            sample_count=sample_count,
+            im=self.processed_image,
+            order=order,
+        )
+        radii = self._get_peak_location(samples).astype(float)
 
         # Return the position in terms of the original length
         radii /= samples_per_pixel
@@ -205,6 +213,9 @@ class BoundaryExtraction:
         Parameters
         ----------
 
+        angle: float or np.ndarray
+            Angle of the sample line, if an array is given then the coordinates for each
+            line are returned one after the other.
         sample_length: float
             Length of the sample strip, given in pixel units
         sample_count: int
@@ -217,11 +228,11 @@ class BoundaryExtraction:
         x1 = x0 + sample_length * np.cos(angle)
         y1 = y0 + sample_length * np.sin(angle)
 
-        # Create the sample line
-        x = np.linspace(x0, x1, sample_count)
-        y = np.linspace(y0, y1, sample_count)
+        # Create the sample line, with one row per angle
+        x = np.linspace(x0, x1, sample_count, axis=-1)
+        y = np.linspace(y0, y1, sample_count, axis=-1)
 
-        interpolation_coords = np.vstack((x, y))
+        interpolation_coords = np.vstack((x.ravel(), y.ravel()))
         return interpolation_coords
 
     def _sample_at_angle(self, angle, sample_length, sample_count, im=None, order=3):
@@ -229,7 +240,7 @@ class BoundaryExtraction:
 
         Parameters
         ----------
-        angle: float
+        angle: float or np.ndarray
             Angle of the sample line, relative to the x-axis
         sample_length: float
             Length of the sample in pixels in the original image.
@@ -243,7 +254,8 @@ class BoundaryExtraction:
         Returns
         -------
         array
-            Interpolated values.
+            Interpolated values, with shape ``(n_angles, sample_count)`` if an array of
+            angles is given.
 
         """
         if im is None:
@@ -253,17 +265,35 @@ class BoundaryExtraction:
             angle=angle, sample_length=sample_length, sample_count=sample_count,
         )
 
-        zi = ndi.map_coordinates(im, interpolationCoords, order=order)
-        return zi
+        if im is self.processed_image and order > 1:
+            # Sample the cached coefficients rather than filtering the crop again
+            coefficients = self._get_spline_coefficients(order)
+            zi = ndi.map_coordinates(coefficients, interpolationCoords, order=order, prefilter=False)
+        else:
+            zi = ndi.map_coordinates(im, interpolationCoords, order=order)
+        return zi.reshape(np.shape(angle) + (sample_count,))
+
+    def _get_spline_coefficients(self, order):
+        """ Spline coefficients of the processed image for the given order.
+
+        ``map_coordinates`` otherwise repeats this prefilter over the whole crop on every
+        call. This matches the filter that it applies internally with the default
+        ``mode="constant"``, so the interpolated values are unchanged.
+        """
+        if order not in self._spline_coefficients:
+            self._spline_coefficients[order] = ndi.spline_filter(
+                self.processed_image, order, output=np.float64, mode="constant"
+            )
+        return self._spline_coefficients[order]
 
     @staticmethod
     def _get_peak_location(sample):
         """ Get the peak in the given sample.
 
         We return the maximum of the given sample, however this might be extended to
-        include more complex methods.
+        include more complex methods. For a 2D array this is taken along each row.
         """
-        return np.argmax(sample)
+        return np.argmax(sample, axis=-1)
 
 
 class _BoundaryExtractionMethod:
@@ -357,6 +387,9 @@ class _BoundaryExtractionGradient(_BoundaryExtractionMethod):
 
         """
         if image is None:
+            # Use the gradient of the preprocessed frame if available
+            if self.granule.x_grad is not None:
+                return self.granule.x_grad, self.granule.y_grad
             image = self.granule.im_smoothed
 
         kern = kernels.fourth_order
@@ -388,54 +421,433 @@ class _BoundaryExtractionMagnitude(_BoundaryExtractionMethod):
         return processed_image
 
 
+class FrameBoundaryExtraction:
+    """ Draw the boundaries of all of the granules in a frame at once.
+
+    This gives the same boundaries as a ``BoundaryExtraction`` per granule, but the crops
+    are stacked into a single padded array so that the gradients, radial projections and
+    the sampling along each ray are a handful of array operations for the whole frame.
+
+    Parameters
+    ----------
+
+    granules: Iterable[Granule]
+        The granules detected in the frame.
+    boundary_method: str
+        Either "gradient" or "intensity", as for ``BoundaryExtraction``.
+    max_samples: int
+        Upper limit on the number of points interpolated in a single call, the granules
+        are sampled in groups to keep the memory use of crowded frames bounded.
+
+    Attributes
+    ----------
+
+    boundaries: list[BoundaryExtraction]
+        One per granule, the processed image, angles and radii are filled in by
+        ``angle_sweep``.
+
+    """
+
+    # Padding needed by the fourth order gradient kernel
+    _gradient_padding = 2
+
+    def __init__(self, granules: Iterable[Granule], boundary_method, max_samples: int = 2 ** 22):
+        if boundary_method not in ("gradient", "intensity"):
+            raise Exception("invalid boundary method, check config file")
+        self.boundary_method = boundary_method
+        self.max_samples = max_samples
+
+        self.boundaries = [BoundaryExtraction(granule, boundary_method) for granule in granules]
+        self.shapes = np.array([b.granule.im_smoothed.shape for b in self.boundaries], dtype=int).reshape(-1, 2)
+        self.local_centres = np.array([b.granule.local_centre for b in self.boundaries], dtype=float).reshape(-1, 2)
+
+        self.angles = None
+        self.radii = None
+        self.processed_images = None
+
+    def __len__(self):
+        return len(self.boundaries)
+
+    def process_images(self):
+        """ Processed images of every granule, as a single ``(n_granules, H, W)`` array.
+
+        Each crop sits in the top-left corner of its slot, the rest of the slot is
+        undefined. The processed image of each granule is also set on its
+        ``BoundaryExtraction`` as a view into this array.
+        """
+        if self.processed_images is not None:
+            return self.processed_images
+
+        height, width = self.shapes.max(axis=0, initial=0)
+        granules = [boundary.granule for boundary in self.boundaries]
+
+        if self.boundary_method == "gradient" and granules and all(g.x_grad is not None for g in granules):
+            # The gradient has already been calculated over the whole frame
+            x_grad = self._stack_crops([g.x_grad for g in granules], height, width)
+            y_grad = self._stack_crops([g.y_grad for g in granules], height, width)
+        elif self.boundary_method == "gradient":
+            # Pad each crop as the gradient kernel would, so that the crop is filtered as
+            # if it were on its own
+            pad = self._gradient_padding
+            stack = self._stack_crops([g.im_smoothed for g in granules], height, width, pad)
+            kern = kernels.fourth_order
+            x_grad = kern.gradient_x(stack)[:, pad : pad + height, pad : pad + width]
+            y_grad = kern.gradient_y(stack)[:, pad : pad + height, pad : pad + width]
+
+        if self.boundary_method == "gradient":
+            # The unit vector away from the centre of each granule
+            xx = np.arange(width)[None, None, :] - self.local_centres[:, 0, None, None]
+            yy = np.arange(height)[None, :, None] - self.local_centres[:, 1, None, None]
+            mag = -np.sqrt(xx ** 2 + yy ** 2)
+
+            processed = x_grad * (xx / mag) + y_grad * (yy / mag)
+        else:
+            processed = self._stack_crops([g.im_smoothed for g in granules], height, width)
+
+        for num, boundary in enumerate(self.boundaries):
+            crop_height, crop_width = self.shapes[num]
+            boundary.processed_image = processed[num, :crop_height, :crop_width]
+
+        self.processed_images = processed
+        return processed
+
+    @staticmethod
+    def _stack_crops(crops, height, width, pad=0):
+        """ Place the crops in the corner of a ``(n, height, width)`` array.
+
+        The crops are padded symmetrically by ``pad`` pixels, matching the "reflect" mode of
+        the gradient kernels.
+        """
+        stack = np.zeros((len(crops), height + 2 * pad, width + 2 * pad))
+        for num, crop in enumerate(crops):
+            crop_height, crop_width = crop.shape
+            stack[num, : crop_height + 2 * pad, : crop_width + 2 * pad] = np.pad(crop, pad, mode="symmetric")
+        return stack
+
+    def angle_sweep(self, n_angles, samples_per_pixel=5, order=3):
+        """Measure the border of every granule, as in ``BoundaryExtraction.angle_sweep``.
+
+        Returns
+        -------
+
+        angles: np.ndarray
+            The sampling angles for the boundaries
+        radii: np.ndarray
+            The boundary of each granule, with shape ``(n_granules, n_angles)``.
+
+        """
+        self.process_images()
+
+        angles = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
+        radii = np.zeros((len(self), n_angles))
+
+        # Each ray is as long as the crop is tall, so larger granules have more samples
+        sample_counts = self.shapes[:, 0] * samples_per_pixel
+        start = 0
+        while start < len(self):
+            stop = start + 1
+            while (
+                stop < len(self)
+                and (stop + 1 - start) * n_angles * sample_counts[start : stop + 1].max() <= self.max_samples
+            ):
+                stop += 1
+            samples = self._sample_granules(slice(start, stop), angles, samples_per_pixel, order)
+            radii[start:stop] = self._get_peak_location(samples)
+            start = stop
+
+        # Return the position in terms of the original length
+        radii /= samples_per_pixel
+
+        for boundary, granule_radii in zip(self.boundaries, radii):
+            boundary.angles = angles
+            boundary.radii = granule_radii
+
+        self.angles = angles
+        self.radii = radii
+        return angles, radii
+
+    def _sample_granules(self, granules: slice, angles, samples_per_pixel, order):
+        """ Sample the rays of a group of granules in a single interpolation call.
+
+        Returns an ``(n_granules, n_angles, max_samples)`` array, the samples past the end
+        of the shorter rays are ``-inf`` so that they are never the peak.
+        """
+        shapes = self.shapes[granules]
+        boundaries = self.boundaries[granules]
+        sample_counts = shapes[:, 0] * samples_per_pixel
+        sample_count = sample_counts.max()
+
+        # Sample lines from the centre of each granule, matching np.linspace
+        y0, x0 = self.local_centres[granules].T
+        sample_length = shapes[:, 0]
+        x1 = x0[:, None] + sample_length[:, None] * np.cos(angles)
+        y1 = y0[:, None] + sample_length[:, None] * np.sin(angles)
+
+        steps = np.arange(sample_count)
+        divisions = (sample_counts - 1)[:, None, None]
+        x = steps * ((x1 - x0[:, None])[..., None] / divisions) + x0[:, None, None]
+        y = steps * ((y1 - y0[:, None])[..., None] / divisions) + y0[:, None, None]
+        last = steps == (sample_counts - 1)[:, None, None]
+        x = np.where(last, x1[..., None], x)
+        y = np.where(last, y1[..., None], y)
+
+        # Points outside of a crop are zero, as in ``map_coordinates`` with a constant mode
+        crop_height = (shapes[:, 0] - 1)[:, None, None]
+        crop_width = (shapes[:, 1] - 1)[:, None, None]
+        on_ray = steps < sample_counts[:, None, None]
+        inside = on_ray & (x >= 0) & (x <= crop_height) & (y >= 0) & (y <= crop_width)
+
+        # Stack the mirrored spline coefficients of each crop on top of each other, the
+        # padding is wide enough that the crops do not influence each other
+        pad = max(order, 1)
+        height, width = shapes.max(axis=0)
+        mosaic = np.zeros((len(boundaries), height + 2 * pad, width + 2 * pad))
+        for num, boundary in enumerate(boundaries):
+            coefficients = (
+                boundary._get_spline_coefficients(order) if order > 1 else boundary.processed_image
+            )
+            mosaic[num, : shapes[num, 0] + 2 * pad, : shapes[num, 1] + 2 * pad] = np.pad(
+                coefficients, pad, mode="reflect"
+            )
+
+        row_offsets = (np.arange(len(boundaries)) * (height + 2 * pad) + pad)[:, None, None]
+        row_offsets = np.broadcast_to(row_offsets, inside.shape)
+        coords = np.vstack((x[inside] + row_offsets[inside], y[inside] + pad))
+
+        samples = np.where(np.broadcast_to(on_ray, inside.shape), 0.0, -np.inf)
+        samples[inside] = ndi.map_coordinates(
+            mosaic.reshape(-1, mosaic.shape[-1]), coords, order=order, prefilter=False
+        )
+        return samples
+
+    @staticmethod
+    def _get_peak_location(samples):
+        """ Peak of each ray, see ``BoundaryExtraction._get_peak_location``. """
+        return np.argmax(samples, axis=-1)
+
+
+# Columns of the long format Fourier table, with one row per granule, frame and order
+LONG_COLUMNS = [
+    "im_path",
+    "frame",
+    "granule_id",
+    "order",
+    "magnitude",
+    "order_1",
+    "x",
+    "y",
+    "bbox_left",
+    "bbox_bottom",
+    "bbox_right",
+    "bbox_top",
+    "mean_radius",
+    "valid",
+    "major_axis",
+    "minor_axis",
+    "eccentricity",
+    "mean_intensity",
+    "timestamp",
+]
+
+
+def magnitude_column(order: int) -> str:
+    """ Name of the column holding the magnitudes of ``order`` in the wide table. """
+    return f"magnitude_{order}"
+
+
+def wide_to_long(wide_table: pd.DataFrame, orders, im_path: str) -> pd.DataFrame:
+    """Convert the wide Fourier table, with a row per granule and frame, to the long format.
+
+    The long format has a row for each order, with the granule values repeated. The
+    ``im_path`` is not stored in the wide table as it is the same for every row.
+    """
+    orders = np.asarray(orders, dtype=np.int64)
+    n_orders = len(orders)
+    n_rows = len(wide_table) * n_orders
+
+    magnitude_columns = [magnitude_column(order) for order in orders]
+    columns = {}
+    for name in LONG_COLUMNS:
+        if name == "im_path":
+            columns[name] = np.full(n_rows, im_path, dtype=object)
+        elif name == "order":
+            columns[name] = np.tile(orders, len(wide_table))
+        elif name == "magnitude":
+            columns[name] = wide_table[magnitude_columns].to_numpy(dtype=np.complex128).ravel()
+        else:
+            columns[name] = np.repeat(wide_table[name].to_numpy(), n_orders)
+    return pd.DataFrame(columns)
+
+
+class FourierRecordBuffer:
+    """ Growable columnar store of the Fourier terms, with one row per granule and frame.
+
+    Each column is a preallocated NumPy array that doubles in size when full, so frames
+    are appended without creating intermediate ``pd.DataFrame`` objects. The magnitudes
+    are held as a single ``(rows, orders)`` complex array. The table is only created
+    once, by ``to_wide`` or ``to_dataframe``, when it is written out.
+    """
+
+    # Columns for each granule in the order that they are written, with their types
+    columns = {
+        "frame": np.int64,
+        "granule_id": np.int64,
+        "order_1": np.complex128,
+        "x": np.float64,
+        "y": np.float64,
+        "bbox_left": np.int64,
+        "bbox_bottom": np.int64,
+        "bbox_right": np.int64,
+        "bbox_top": np.int64,
+        "mean_radius": np.float64,
+        "valid": bool,
+        "major_axis": np.float64,
+        "minor_axis": np.float64,
+        "eccentricity": np.float64,
+        "mean_intensity": np.float64,
+        "timestamp": object,
+    }
+
+    def __init__(self, capacity: int = 256):
+        self._size = 0
+        self._data = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.columns.items()}
+        self._magnitudes = None
+        self.orders = None
+        self.im_path = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._data["frame"])
+
+    def _reserve(self, n_rows):
+        """ Ensure there is space for another ``n_rows`` rows. """
+        required = self._size + n_rows
+        if required <= self.capacity:
+            return
+        capacity = max(self.capacity, 1)
+        while capacity < required:
+            capacity *= 2
+        for name, column in self._data.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[: self._size] = column[: self._size]
+            self._data[name] = grown
+        grown = np.empty((capacity, len(self.orders)), dtype=np.complex128)
+        grown[: self._size] = self._magnitudes[: self._size]
+        self._magnitudes = grown
+
+    def append_frame(self, orders, magnitudes, im_path: str, **granule_values):
+        """ Add the Fourier terms of every granule within a frame.
+
+        Parameters
+        ----------
+
+        orders: np.ndarray
+            The orders of the Fourier terms, these must be the same for every frame.
+        magnitudes: np.ndarray
+            The complex magnitudes, with shape ``(n_granules, n_orders)``.
+        im_path: str
+            The path of the microscope image, the same for every frame.
+        granule_values:
+            The remaining columns, either a value per granule or a single value for the
+            whole frame.
+        """
+        orders = np.asarray(orders, dtype=np.int64)
+        if self.orders is None:
+            self.orders = orders
+            self.im_path = im_path
+            self._magnitudes = np.empty((self.capacity, len(orders)), dtype=np.complex128)
+        elif not np.array_equal(orders, self.orders):
+            raise ValueError("The Fourier orders must be the same for every frame.")
+
+        magnitudes = np.asarray(magnitudes).reshape(-1, len(orders))
+        n_granules = len(magnitudes)
+
+        missing = set(self.columns) - set(granule_values)
+        if missing:
+            raise ValueError(f"Missing columns for the Fourier terms: {sorted(missing)}")
+
+        self._reserve(n_granules)
+        rows = slice(self._size, self._size + n_granules)
+        self._magnitudes[rows] = magnitudes
+        for name, value in granule_values.items():
+            self._data[name][rows] = value
+        self._size += n_granules
+
+    def to_wide(self) -> pd.DataFrame:
+        """ Return the stored rows with a column for the magnitudes of each order. """
+        table = pd.DataFrame({name: column[: self._size] for name, column in self._data.items()})
+        if self.orders is not None:
+            magnitudes = pd.DataFrame(
+                self._magnitudes[: self._size], columns=[magnitude_column(order) for order in self.orders]
+            )
+            table = pd.concat([table, magnitudes], axis=1)
+        return table
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """ Return the stored rows in the long format, with one row per order. """
+        if self.orders is None:
+            return pd.DataFrame({name: [] for name in LONG_COLUMNS})
+        return wide_to_long(self.to_wide(), self.orders, self.im_path)
+
+    def clear(self):
+        """ Remove the stored rows, keeping the allocated space. """
+        self._size = 0
+
+
 def collect_fourier_terms(
     fourier_terms: Iterable[BoundaryExtraction],
     frame: MicroscopeFrame,
     granule_tracker,
     plot: bool = False,
     output_dir: Path = None,
-) -> pd.DataFrame:
+    records: FourierRecordBuffer = None,
+    max_order: int = 59,
+):
     """ Gather a list of Fourier terms into a single form and add metadata.
 
-    This gathers all the information from a given into a ``pd.DataFrame``.
+    This gathers all the information from a given into a ``pd.DataFrame``. If a
+    ``FourierRecordBuffer`` is given as ``records`` then the terms are appended to it
+    instead, and the buffer is returned. Only the modes up to ``max_order`` are kept.
     """
+    return_table = records is None
+    if return_table:
+        records = FourierRecordBuffer()
 
-    components = []
     new_pos = [fourier.granule.image_centre for fourier in fourier_terms]
 
     granule_ids = granule_tracker.link_granules(new_pos)
 
+    # Collect the values for each granule, these are added to the records once per frame
+    magnitudes, order_1 = [], []
+    frame_columns = ("frame", "order_1", "timestamp")  # Not collected per granule below
+    granule_values = {name: [] for name in FourierRecordBuffer.columns if name not in frame_columns}
+    orders = None
     for granule_id, fourier in zip(granule_ids, fourier_terms):
 
-        angles, radii = fourier.angle_sweep(400, samples_per_pixel=15, order=4)
-        magnitude, orders, order_1 = fourier.get_fourier_terms(radii)
-
-        major_axis = fourier.granule.properties["major_axis_length"] * frame.pixel_size
-        minor_axis = fourier.granule.properties["minor_axis_length"] * frame.pixel_size
-        eccentricity = fourier.granule.properties["eccentricity"]
-        mean_intensity = fourier.granule.properties["mean_intensity"]
-        df_temp = pd.DataFrame(
-            {
-                "granule_id": granule_id,
-                "order": orders.astype(int),
-                "magnitude": magnitude,
-                "order_1": order_1,
-                "x": fourier.granule.image_centre[0],
-                "y": fourier.granule.image_centre[1],
-                "bbox_left": fourier.granule.bbox[0],
-                "bbox_bottom": fourier.granule.bbox[1],
-                "bbox_right": fourier.granule.bbox[2],
-                "bbox_top": fourier.granule.bbox[3],
-                "mean_radius": fourier.mean_radius_pixels * frame.pixel_size,
-                "valid": fourier.validate_boundary(),
-                "major_axis": major_axis,
-                "minor_axis": minor_axis,
-                "eccentricity": eccentricity,
-                "mean_intensity": mean_intensity,
-                "timestamp": str(frame.timestamp)
-            }
-        )
-        components.append(df_temp)
+        # The boundary may have already been drawn, for instance in a frame worker
+        if fourier.radii is None:
+            fourier.angle_sweep(400, samples_per_pixel=15, order=4)
+        magnitude, orders, granule_order_1 = fourier.get_fourier_terms(fourier.radii, max_order)
+        magnitudes.append(magnitude)
+        order_1.append(granule_order_1)
+
+        properties = fourier.granule.properties
+        granule_values["granule_id"].append(granule_id)
+        granule_values["x"].append(fourier.granule.image_centre[0])
+        granule_values["y"].append(fourier.granule.image_centre[1])
+        granule_values["bbox_left"].append(fourier.granule.bbox[0])
+        granule_values["bbox_bottom"].append(fourier.granule.bbox[1])
+        granule_values["bbox_right"].append(fourier.granule.bbox[2])
+        granule_values["bbox_top"].append(fourier.granule.bbox[3])
+        granule_values["mean_radius"].append(fourier.mean_radius_pixels * frame.pixel_size)
+        granule_values["valid"].append(fourier.validate_boundary())
+        granule_values["major_axis"].append(properties["major_axis_length"] * frame.pixel_size)
+        granule_values["minor_axis"].append(properties["minor_axis_length"] * frame.pixel_size)
+        granule_values["eccentricity"].append(properties["eccentricity"])
+        granule_values["mean_intensity"].append(properties["mean_intensity"])
 
         # Plot the outline of the granule
         if plot: #!jl and granule_id < 35:
@@ -449,10 +861,20 @@ def collect_fourier_terms(
 
             fourier.plot(save_name=plot_save_name, dpi=110)
 
-    aggregate = pd.concat(components, ignore_index=False)
-    aggregate.insert(0, "frame", frame.frame_num)
-    aggregate.insert(0,"im_path",str(frame.im_path))
-    return aggregate
+    if orders is not None:
+        records.append_frame(
+            orders.astype(int),
+            np.array(magnitudes),
+            im_path=str(frame.im_path),
+            frame=frame.frame_num,
+            order_1=np.array(order_1),
+            timestamp=str(frame.timestamp),
+            **granule_values,
+        )
+
+    if return_table:
+        return records.to_dataframe()
+    return records
 
 
 class _GranuleLinker:
@@ -460,7 +882,8 @@ class _GranuleLinker:
     def __init__(self, memory=3, max_distance=15):
         self._stored_positions = None
         self._stored_labels = None
-        self._memory_counter = {}
+        # Number of frames left before a missing granule is forgotten, zero if present
+        self._missing_counts = None
         self.max_id = 0
         self.memory = memory
         self.max_distance = max_distance
@@ -486,11 +909,13 @@ class _GranuleLinker:
         -------
         labels: The labels for the the input granules in order.
         """ 
-       
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+
         if self._init:
             #On the first frame no linking is needed
             self._stored_positions = positions.copy()
             self._stored_labels = np.arange(len(positions), dtype=int)
+            self._missing_counts = np.zeros(len(positions), dtype=int)
             labels = np.arange(len(positions), dtype=int)
             self.max_id = len(positions) - 1
             self._init = False
@@ -498,71 +923,77 @@ class _GranuleLinker:
         
         #Otherwise, link
         n_granules = len(positions)
-        n_stored = len(self._stored_positions)
         labels = np.zeros(n_granules, dtype=int)
         if n_granules < 1:
             raise GranuleNotFoundError
 
-        handled_granules = np.full(len(positions),False)
-        handled_stored = np.full(len(self._stored_positions),False)    
-
-        distances =cdist(positions,self._stored_positions)
-
-        smallest_array = min(n_granules,n_stored)
-
-        for i in range(smallest_array):
-            # Find the granule that has moved the least between the two frames
-            new_index, old_index = np.unravel_index(
-                np.nanargmin(distances, axis=None), distances.shape
-            )
-
-            # Test if the distances between the granule is larger than a given distance
-            displacement = distances[new_index, old_index]
-            if self.max_distance is not None and displacement > self.max_distance:
-                break
-
-            #if not, these are the same granule
-            label = self._stored_labels[old_index]
-            labels[new_index] = label
-            self._stored_positions[old_index] = positions[new_index]
-            handled_granules[new_index] = True
-            handled_stored[old_index] = True
-            distances[new_index, :] = np.NaN
-            distances[:,old_index] = np.NaN
+        new_index, old_index = self._match(positions)
+
+        # Matched granules take the label, and the new position, of the stored granule
+        labels[new_index] = self._stored_labels[old_index]
+        self._stored_positions[old_index] = positions[new_index]
+        handled_granules = np.full(n_granules, False)
+        handled_granules[new_index] = True
+        handled_stored = np.full(len(self._stored_positions), False)
+        handled_stored[old_index] = True
+
+        # Count down the granules that are missing, forgetting them once they have been
+        # missing for ``memory`` frames
+        counts = self._missing_counts
+        counts[handled_stored] = 0
+        missing = ~handled_stored
+        for_removal = missing & (counts == 1)
+        counts[missing & (counts > 1)] -= 1
+        counts[missing & (counts == 0)] = self.memory
 
         #handle newly appeared granules
-        unhandled = [positions[i] for i,x in enumerate(handled_granules) if x == False]
-        if unhandled != []:
-            tail_labels = np.arange(self.max_id + 1, self.max_id + 1 + len(unhandled))
-            self._stored_labels = np.append(self._stored_labels,tail_labels)
-            self._stored_positions = np.append(self._stored_positions,unhandled,axis=0)
-            self.max_id += len(unhandled)
-
-        #handle missing granules
-        missing = [i for i,x in enumerate(handled_stored) if x == False] #position in _storedlists
-        missing_ids = [self._stored_labels[i] for i in missing] #granule index
-        for_removal = []
-        found = []
-
-        for granule_id in self._memory_counter:
-            if granule_id not in missing_ids:
-                found.append(granule_id)
-        for granule_id in found:
-            del self._memory_counter[granule_id]
-
-        for granule_id,index in zip(missing_ids,missing):
-            if granule_id in self._memory_counter:
-                if self._memory_counter[granule_id] == 1:
-                    del self._memory_counter[granule_id]
-                    for_removal.append(index)
-                else:
-                    self._memory_counter[granule_id] -= 1
-            else:
-                self._memory_counter[granule_id] = self.memory
-
-        self._stored_positions = np.delete(self._stored_positions,for_removal,axis=0)
-        self._stored_labels = np.delete(self._stored_labels,for_removal)
-        # print("In2: ",self._memory_counter, for_removal,self.max_id)
-        # print(self._stored_labels)
-        # print(self._stored_positions)
-        return labels
\ No newline at end of file
+        n_unhandled = np.count_nonzero(~handled_granules)
+        if n_unhandled:
+            tail_labels = np.arange(self.max_id + 1, self.max_id + 1 + n_unhandled)
+            labels[~handled_granules] = tail_labels
+            self._stored_labels = np.append(self._stored_labels, tail_labels)
+            self._stored_positions = np.append(self._stored_positions, positions[~handled_granules], axis=0)
+            self._missing_counts = np.append(counts, np.zeros(n_unhandled, dtype=int))
+            for_removal = np.append(for_removal, np.full(n_unhandled, False))
+            self.max_id += n_unhandled
+
+        keep = ~for_removal
+        self._stored_positions = self._stored_positions[keep]
+        self._stored_labels = self._stored_labels[keep]
+        self._missing_counts = self._missing_counts[keep]
+        return labels
+
+    def _match(self, positions):
+        """Greedily pair the new positions with the stored positions.
+
+        The closest remaining pair is matched first, until there are no pairs within
+        ``max_distance``; ties are broken by the new, then the stored, index. Only the pairs
+        within ``max_distance`` of each other are found, using a KD-tree, so this scales
+        with the number of nearby pairs rather than the square of the number of granules.
+
+        Returns the indices of the matched new and stored positions.
+        """
+        stored = self._stored_positions
+        if len(stored) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        max_distance = np.inf if self.max_distance is None else self.max_distance
+        pairs = cKDTree(positions).sparse_distance_matrix(
+            cKDTree(stored), max_distance, output_type="ndarray"
+        )
+        new_candidates = pairs["i"].astype(int)
+        old_candidates = pairs["j"].astype(int)
+        # Recalculate the distances as ``cdist`` would, so that ties resolve identically
+        distances = np.sqrt(((positions[new_candidates] - stored[old_candidates]) ** 2).sum(axis=1))
+
+        order = np.lexsort((old_candidates, new_candidates, distances))
+        new_taken = np.full(len(positions), False)
+        old_taken = np.full(len(stored), False)
+        new_index, old_index = [], []
+        for new, old in zip(new_candidates[order], old_candidates[order]):
+            if new_taken[new] or old_taken[old]:
+                continue
+            new_taken[new] = old_taken[old] = True
+            new_index.append(new)
+            old_index.append(old)
+        return np.array(new_index, dtype=int), np.array(old_index, dtype=int)
@@ -28,6 +28,8 @@ SCHEMA = yaml.Map(
                 "image_dir": yaml.Str(),
                 "image_regex": yaml.Str(),
                 "experiment_name": yaml.Str(),
+                "compression": yaml.Str(),
+                "compression_level": yaml.Int(),
             }
         ),
         "image_processing": yaml.Map(
@@ -41,13 +43,19 @@ SCHEMA = yaml.Map(
                 "granule_minimum_intensity": yaml.Float(),
                 "fill_threshold": yaml.Float(),
                 "tracking_threshold": yaml.Float(),
-                "granule_images": yaml.Bool()
+                "granule_images": yaml.Bool(),
+                "frame_prefetch": yaml.Int(),
+                "frame_preprocessing": yaml.Bool(),
+                "max_stored_order": yaml.Int(),
+                "checkpoint_interval": yaml.Int(),
             }
         ),
         "spectrum_fitting": yaml.Map(
             {
                 "experimental_spectrum": yaml.Str(), 
                 "fitting_orders": yaml.Int(),
+                "fitting_method": yaml.Str(),
+                "analytic_jacobian": yaml.Bool(),
                 "temperature": yaml.Float(),
                 "plot_spectra_and_heatmaps": yaml.Bool(),
             }
@@ -40,8 +40,19 @@ Microscope files are surprisingly in-homogeneous, we currently support the follo
 types:
 
 - DONE: Andor: .ims, .lif, .ome.tif
+- DONE: Plain and ImageJ .tif stacks
 - ON-GOING: Zeiss: .czi
 
+TIFF files
+----------
+
+TIFF and OME-TIFF stacks do not need bioformats at all. These are read by ``tiffGen``
+using ``tifffile``, the OME-XML header is parsed directly for the pixel size and the
+timestamps. Where the pixel data is stored uncompressed and contiguously, the file is
+memory-mapped and each ``MicroscopeFrame`` holds a view into the file, rather than a
+copy. As the javaVM is never started for these files, the worker processes may be reused
+between images.
+
 Outline
 -------
 
@@ -61,11 +72,18 @@ FrameGen
 MicroscopeFrame
     Container for the frame image and metadata unique to that frame.
 
+FramePrefetcher
+    Wraps a frame generator, decoding upcoming frames on a background thread while the
+    current frame is analysed.
+
 
 """
 
 import datetime
 import enum
+import queue
+import re
+import threading
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 from functools import wraps
@@ -75,10 +93,12 @@ import warnings
 import bioformats as bf
 import javabridge
 import numpy as np
+import tifffile
 
 from flickerprint.common.configuration import config
 
 JAVAVM_STARTED = False
+_ACTIVE_PREFETCHERS = set()
 
 
 @dataclass
@@ -133,43 +153,222 @@ class GeneratorTypes(enum.Enum):
     PNG = 3
 
 
-def gen_opener(im_path):
+def gen_opener(im_path, start_frame: int = 0):
     """Return a generator based on the provided ``image_path``.
 
     For now we simply search for the correct extension.
-    A generator for the ``MicroscopeFrames`` s and common metadata.
+    A generator for the ``MicroscopeFrames`` s and common metadata, beginning at
+    ``start_frame``; the earlier frames are not read.
     """
     im_path = Path(im_path)
     image_type = _getType(im_path)
     if image_type == GeneratorTypes.BIOFORMATS:
-        return bioformatsGen(im_path)
+        # Start the vm here, rather than inside the generator, so that it is owned by the
+        # calling thread even if the frames are later read by a ``FramePrefetcher``.
+        if not JAVAVM_STARTED:
+            startVM()
+        return bioformatsGen(im_path, start_frame)
+    elif image_type == GeneratorTypes.TIFF:
+        return tiffGen(im_path, start_frame)
     else:
-        raise NotImplementedError("Currently not handling not-bioformats files.")
+        raise NotImplementedError(f"Currently not handling PNG files: {im_path}")
+
+
+def requires_jvm(im_path) -> bool:
+    """ Return True if opening ``im_path`` requires the javaVM. """
+    return _getType(Path(im_path)) == GeneratorTypes.BIOFORMATS
 
 
 def _getType(im_path: Path):
     """ Return the required generator type based on the image extension. """
     extentions = im_path.suffixes
     if extentions[-2:] == ['.ome','.tif'] or extentions[-2:] == ['.ome','.tiff']:
-        return GeneratorTypes.BIOFORMATS
+        return GeneratorTypes.TIFF
     elif extentions[-1] in [".ims",".lif"]:
         return GeneratorTypes.BIOFORMATS
     elif extentions[-1] == "png":
         return GeneratorTypes.PNG
     elif extentions[-1] in [".tiff", ".tif"]:
-        return GeneratorTypes.BIOFORMATS
+        return GeneratorTypes.TIFF
     else:
         return GeneratorTypes.BIOFORMATS
 
 
-def bioformatsGen(im_path):
+def tiffGen(im_path, start_frame: int = 0):
+    """Load an image from a TIFF or OME-TIFF file without the javaVM.
+
+    The pixel data is memory-mapped where possible, so that each frame is a view into
+    the file. Compressed or fragmented files are instead decoded one page at a time.
+    """
+    try:
+        tif = tifffile.TiffFile(str(im_path))
+        series = tif.series[0]
+    except Exception:
+        raise ValueError(f"\n\n\nCould not open image file {str(im_path)} as a TIFF: unsupported or corrupted file.\n\n")
+
+    with tif:
+        if tif.ome_metadata is not None:
+            pixel_size, time_stamps, actual_timestamp = _getOMEmetadata(tif.ome_metadata)
+        else:
+            pixel_size, time_stamps, actual_timestamp = _getImageJmetadata(tif), None, False
+
+        if pixel_size is None:
+            pixel_size = float(config("image_processing", "pixel_size"))
+            warnings.warn(f"Warning: pixel size missing from metadata, falling back on value in config file: {pixel_size} microns.")
+
+        # Reduce the series to a (time, y, x) stack, taking the first channel as bioformats does
+        axes = series.axes
+        page_axes = series.keyframe.axes
+        stack_axes = axes[: len(axes) - len(page_axes)]
+        time_axes = [axis for axis in stack_axes if axis in "TIQ"]
+        if "Z" in stack_axes and series.shape[axes.index("Z")] > 1:
+            raise ValueError("Currently we don't support 3D images. If the microscope image is supposed to be a time series, please use the hyperstacks feature in Fiji to convert it.")
+        frame_axis = time_axes[0] if time_axes else None
+        n_frames = series.shape[axes.index(frame_axis)] if frame_axis is not None else 1
+
+        if time_stamps is None or len(time_stamps) != n_frames:
+            time_stamps = np.zeros(n_frames)
+            actual_timestamp = False
+            warnings.warn("Warning: Cannot read timestamps from this file-type. Setting times to 0")
+
+        # Index of the first channel, slice etc. for every frame in the stack
+        stack_shape = series.shape[: len(stack_axes)]
+        stack_index = [0] * len(stack_axes)
+
+        if series.dataoffset is not None:
+            # The data is contiguous and uncompressed, so we can map it directly
+            dtype = np.dtype(series.dtype).newbyteorder(tif.byteorder)
+            stack = np.memmap(
+                str(im_path), dtype=dtype, mode="r", offset=series.dataoffset, shape=series.shape
+            )
+        else:
+            stack = None
+
+        for frame_num in range(start_frame, n_frames):
+            if frame_axis is not None:
+                stack_index[stack_axes.index(frame_axis)] = frame_num
+            if stack is not None:
+                frame_data = stack[tuple(stack_index)]
+            else:
+                page_num = np.ravel_multi_index(stack_index, stack_shape) if stack_shape else 0
+                frame_data = series.pages[page_num].asarray()
+            if page_axes.endswith("S"):
+                frame_data = frame_data[..., 0]
+
+            yield MicroscopeFrame(
+                im_data=frame_data,
+                im_path=im_path,
+                frame_num=frame_num,
+                total_frames=n_frames,
+                timestamp=time_stamps[frame_num],
+                pixel_size=pixel_size,
+                actual_pixel_size=True,
+                actual_timestamp=actual_timestamp,
+            )
+
+
+def _getOMEmetadata(md):
+    """Return the pixel size and timestamps from an OME-XML header.
+
+    Returns ``(pixel_size, time_stamps, actual_timestamp)``, where the pixel size is None
+    if it is missing and the timestamps are None if they cannot be read.
+    """
+    root = ET.fromstring(md)
+    image = _findTag(root, "Image")
+    pixels = _findTag(image, "Pixels")
+
+    pixel_size = pixels.get("PhysicalSizeX")
+    if pixel_size is not None:
+        pixel_size = float(pixel_size)
+        pixel_sizey = float(pixels.get("PhysicalSizeY", pixel_size))
+        if abs(pixel_size - pixel_sizey) > 1e-3:
+            raise ValueError("Error: pixels must be square")
+        pixel_size = _convertToMicrons(pixel_size, pixels.get("PhysicalSizeXUnit", "µm"))
+
+    # Plane.DeltaT is given relative to the acquisition date, for the first channel and slice
+    n_frames = int(pixels.get("SizeT", 1))
+    acquisition_date = _findTag(image, "AcquisitionDate")
+    planes = [
+        plane for plane in pixels
+        if plane.tag.endswith("Plane") and plane.get("DeltaT") is not None
+        and int(plane.get("TheZ", 0)) == 0 and int(plane.get("TheC", 0)) == 0
+    ]
+    if acquisition_date is None or acquisition_date.text is None or len(planes) != n_frames:
+        return pixel_size, None, False
+
+    # Keep the date to the millisecond and drop any time zone, as the seven digit fractions
+    # and offsets written by some microscopes can't be parsed directly
+    start_match = re.match(
+        r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,3})?", acquisition_date.text.strip()
+    )
+    if start_match is None:
+        return pixel_size, None, False
+    try:
+        startTime = np.datetime64(start_match.group(0), "ms")
+        time_stamps = np.zeros(n_frames, dtype="datetime64[ms]")
+        for plane in planes:
+            t = np.timedelta64(int(round(float(plane.get("DeltaT")) * 1000)), "ms")
+            time_stamps[int(plane.get("TheT", 0))] = startTime + t
+    except (ValueError, IndexError):
+        return pixel_size, None, False
+
+    return pixel_size, time_stamps, True
+
+
+def _getImageJmetadata(tif):
+    """ Return the pixel size of an ImageJ TIFF from the resolution tags, if calibrated. """
+    if not tif.is_imagej:
+        return None
+    unit = tif.imagej_metadata.get("unit", "")
+    resolution = tif.pages[0].tags.get("XResolution")
+    if resolution is None or unit not in ("micron", "um", "µm", "μm"):
+        return None
+    numerator, denominator = resolution.value
+    if numerator == 0:
+        return None
+    return denominator / numerator
+
+
+def _findTag(elem, tag):
+    """ Return the first child of ``elem`` with the given tag, ignoring the xml namespace. """
+    if elem is None:
+        return None
+    for child in elem:
+        if child.tag.endswith(tag):
+            return child
+    return None
+
+
+def _convertToMicrons(pixel_size, pixel_units):
+    """ Convert a pixel size in ``pixel_units`` into microns. """
+    if pixel_units in ("µm", "μm"):
+        return pixel_size
+
+    warnings.warn(f"Warning: pixel size not in microns: attempting to convert.")
+    if pixel_units == "m":
+        pixel_size *= 1e6
+    elif pixel_units == "cm":
+        pixel_size *= 1e4
+    elif pixel_units == "mm":
+        pixel_size *= 1e3
+    elif pixel_units == "nm":
+        pixel_size *= 1e-3
+    elif pixel_units == "pm":
+        pixel_size *= 1e-6
+    else:
+        raise ValueError(f"Error: Pixel unit conversion failed. Units {pixel_units} not recognised")
+    return pixel_size
+
+
+def bioformatsGen(im_path, start_frame: int = 0):
     """ Load an image from a bioformats file. """
+    if not JAVAVM_STARTED:
+        startVM()
     # Get some metadata from the OMEXML data
     try:
         md = bf.get_omexml_metadata(str(im_path))
         o = bf.OMEXML(md)
     except Exception:
-        closeVM()
         raise ValueError(f"\n\n\nCould not open image file {str(im_path)} with bioformats: unsupported or corrupted file.\n\n")
     # Extract the relevant terms
     pixelData = o.image().Pixels
@@ -177,28 +376,12 @@ def bioformatsGen(im_path):
     if pixel_size == None:
         pixel_size = float(config("image_processing", "pixel_size"))
         warnings.warn(f"Warning: pixel size missing from metadata, falling back on value in config file: {pixel_size} microns.")
-        pixel_units = "µm"
     else:
         pixel_sizey = pixelData.PhysicalSizeY
         if abs(pixel_size - pixel_sizey) > 1e-3:
             raise ValueError("Error: pixels must be square")
 
-        pixel_units = pixelData.PhysicalSizeXUnit
-
-        if pixel_units != "µm":
-            warnings.warn(f"Warning: pixel size not in microns: attempting to convert.")
-            if pixel_units == "m":
-                pixel_size *= 1e6
-            elif pixel_units == "cm":
-                pixel_size *= 1e4
-            elif pixel_units == "mm":
-                pixel_size *= 1e4
-            elif pixel_units == "nm":
-                pixel_size *= 1e-3
-            elif pixel_units == "pm":
-                pixel_size *= 1e-6
-            else:
-                raise ValueError(f"Error: Pixel unit conversion failed. Units {pixel_units} not recognised")        
+        pixel_size = _convertToMicrons(pixel_size, pixelData.PhysicalSizeXUnit)
 
     n_slices = pixelData.SizeZ
     if n_slices == None:
@@ -223,12 +406,10 @@ def bioformatsGen(im_path):
         actual_timestamp = False
         warnings.warn("Warning: Cannot read timestamps from this file-type. Setting times to 0")
 
-    if not JAVAVM_STARTED:
-        startVM()
     try:
         with bf.ImageReader(str(im_path)) as reader:
             # For frame in frame_nums
-            for frame_num in range(n_frames):
+            for frame_num in range(start_frame, n_frames):
                 frame_data = reader.read(t=frame_num, z=0, c=0, rescale=False)
                 yield MicroscopeFrame(
                     im_data=frame_data,
@@ -241,7 +422,8 @@ def bioformatsGen(im_path):
                     actual_timestamp=actual_timestamp,
                 )
     except AttributeError:
-        closeVM()
+        # The vm is shutdown by ``vmManager``, which also stops any ``FramePrefetcher``
+        return
 
 def _getIMStimeStamps(n_frames, md) -> np.ndarray:
     """ Return an array with the timestamps for each frame. """
@@ -310,13 +492,118 @@ def _indent(elem, level=0):
             elem.tail = j
     return elem  
 
+class FramePrefetcher:
+    """Read frames ahead of the analysis on a background thread.
+
+    Frames are taken from ``frame_gen`` and held in a queue of at most ``depth`` frames, so
+    that decoding the next frames overlaps with the analysis of the current one. This is
+    a drop-in replacement for the wrapped generator; exceptions raised while reading are
+    re-raised when the corresponding frame is requested.
+
+    The reading thread is attached to the javaVM if it is running. ``closeVM`` stops any
+    active prefetchers before the vm is shutdown, so this is safe to use within
+    ``@vmManager``.
+    """
+
+    _END = object()
+
+    def __init__(self, frame_gen, depth: int = 2):
+        if depth < 1:
+            raise ValueError(f"Prefetch depth must be at least 1, currently {depth}")
+        self._frame_gen = frame_gen
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._read_frames, daemon=True)
+        _ACTIVE_PREFETCHERS.add(self)
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            if self._finished:
+                raise StopIteration
+            try:
+                item = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+            # The reader always queues the end of the frames or its error before exiting
+            if not self._thread.is_alive() and self._queue.empty():
+                self._finished = True
+                raise RuntimeError("Frame reading thread stopped without finishing")
+        if item is self._END:
+            self._finished = True
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self._finished = True
+            raise item
+        return item
+
+    def close(self):
+        """ Stop the reading thread and release the wrapped generator. """
+        self._finished = True
+        self._stop.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        _ACTIVE_PREFETCHERS.discard(self)
+
+    def _read_frames(self):
+        """ Fill the queue from the wrapped generator until exhausted or stopped. """
+        attached = False
+        end = self._END
+        try:
+            if JAVAVM_STARTED:
+                javabridge.attach()
+                attached = True
+            for frame in self._frame_gen:
+                if not self._put(frame):
+                    break
+        except BaseException as err:
+            end = err
+        finally:
+            self._put(end, force=True)
+            if hasattr(self._frame_gen, "close"):
+                self._frame_gen.close()
+            if attached:
+                javabridge.detach()
+
+    def _put(self, item, force: bool = False) -> bool:
+        """Block until there is space in the queue, returning False if we were stopped.
+
+        With ``force`` the item is queued even once stopped, dropping unread frames to make
+        space, so that the end of the frames or an error always reaches the consumer.
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        if not force:
+            return False
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
 def vmManager(bioformatsFunc):
-    """ Decorator to ensure the sane shutdown of the vm. """
+    """Decorator to ensure the sane shutdown of the vm.
+
+    The vm is started lazily by ``bioformatsGen``, so functions that only read TIFF files
+    never start it, and the process remains free to run further images.
+    """
 
     @wraps(bioformatsFunc)
     def wrapper(*args, **kwargs):
-        if not JAVAVM_STARTED:
-            startVM()
         try:
             funcOut = bioformatsFunc(*args, **kwargs)
         finally:
@@ -342,8 +629,10 @@ def startVM():
     return
 
 def closeVM():
-    """ Close the javabridge. """
+    """ Close the javabridge, stopping any threads that are still reading frames. """
     global JAVAVM_STARTED
+    for prefetcher in list(_ACTIVE_PREFETCHERS):
+        prefetcher.close()
     if JAVAVM_STARTED:
         javabridge.kill_vm()
         JAVAVM_STARTED = False
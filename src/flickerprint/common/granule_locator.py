@@ -20,6 +20,10 @@ Granule
     An image of the granule and the surrounding area, along with the location and other
     metadata, including a rough estimate of the granule boundary.
 
+PreprocessedFrame
+    The smoothed frame and its gradient, calculated once so that the ``Granule`` crops
+    are views into these arrays.
+
 """
 
 import pickle
@@ -37,8 +41,10 @@ from skimage.feature import blob_dog, blob_log
 from skimage import segmentation
 
 import flickerprint.tools.plot_tools as pt
+from flickerprint.common import kernels
 from flickerprint.common.configuration import config
 from flickerprint.common.frame_gen import MicroscopeFrame
+from flickerprint.common.utilities import strtobool
 
 
 class GranuleNotFoundError(Exception):
@@ -51,14 +57,36 @@ class GranuleNotFoundError(Exception):
     pass
 
 
+@dataclass
+class PreprocessedFrame:
+    """ The smoothed frame and, for the gradient method, its gradient field. """
+
+    im_smoothed: np.ndarray
+    x_grad: np.ndarray = None
+    y_grad: np.ndarray = None
+
+    @classmethod
+    def from_frame(cls, im_data: np.ndarray, smoothing_width: float, gradient: bool = True):
+        """ Smooth the whole frame and, optionally, calculate its gradient. """
+        im_smoothed = ski.filters.gaussian(im_data, smoothing_width)
+        if not gradient:
+            return cls(im_smoothed)
+
+        kern = kernels.fourth_order
+        return cls(im_smoothed, kern.gradient_x(im_smoothed), kern.gradient_y(im_smoothed))
+
+
 class Granule:
     """Container for a crop of the the microscope image containing the granule.
 
     Extends the crop from the granule detection by ``padding`` pixels to help with
     boundary drawing. This retains the metadata from the microscope frame.
+
+    If a ``PreprocessedFrame`` is given then the smoothed image, and gradient, are views
+    into the preprocessed frame rather than being calculated for the crop.
     """
 
-    def __init__(self, im_data, property_row, padding=5):
+    def __init__(self, im_data, property_row, padding=5, preprocessed: PreprocessedFrame = None):
         """ Get properties from the granule detector. """
         self._im_height, self._im_width = im_data.shape
 
@@ -72,7 +100,14 @@ class Granule:
         self.padding = padding
 
         self.smoothing_width = float(config("image_processing", "smoothing"))
-        self.im_smoothed = ski.filters.gaussian(self.im_cropped, self.smoothing_width)
+        self.x_grad = self.y_grad = None
+        if preprocessed is None:
+            self.im_smoothed = ski.filters.gaussian(self.im_cropped, self.smoothing_width)
+        else:
+            self.im_smoothed = self._slice_image(preprocessed.im_smoothed, padding=padding)
+            if preprocessed.x_grad is not None:
+                self.x_grad = self._slice_image(preprocessed.x_grad, padding=padding)
+                self.y_grad = self._slice_image(preprocessed.y_grad, padding=padding)
         self.crop_width, self.crop_height = self.im_cropped.shape
 
         # Centre of the granule relative to the entire image
@@ -179,9 +214,25 @@ class GranuleDetector:
             self.labelGranules()
 
         granule_table = self._getTable()
+        preprocessed = self.preprocess()
 
         for row in granule_table.itertuples():
-            yield Granule(self.frame.im_data, row, padding=padding)
+            yield Granule(self.frame.im_data, row, padding=padding, preprocessed=preprocessed)
+
+    def preprocess(self):
+        """Smooth the whole frame once, if ``frame_preprocessing`` is enabled.
+
+        Returns None if the granules should be smoothed separately.
+        """
+        if not strtobool(config("image_processing", "frame_preprocessing")):
+            return None
+        if not hasattr(self, "preprocessed"):
+            self.preprocessed = PreprocessedFrame.from_frame(
+                self.frame.im_data,
+                float(config("image_processing", "smoothing")),
+                gradient=config("image_processing", "method") == "gradient",
+            )
+        return self.preprocessed
 
     def labelGranules(self):
         """Label the granules within the images.
@@ -272,17 +323,23 @@ class GranuleDetector:
 
         These are split using the flood fill method.
         """
-        # Generate a masked binary image for each of the granules, removing those
-        # where we fail to find a granule
-        masks = [self._fillGranule(b) for b in self.granule_locations]
-        masks = list(filter(lambda m: m is not None, masks))
-        masks = np.array(masks, dtype=np.int16)
-
-        if len(masks) == 0:
+        self.max_intensity = self.processed_image.max()
+
+        # Paint the flood fill of each granule into a single mask, removing those where we
+        # fail to find a granule. Overlapping regions are merged.
+        self.mask = np.zeros(self.processed_image.shape, dtype=bool)
+        n_filled = 0
+        for blob in self.granule_locations:
+            filled = self._fillGranule(blob)
+            if filled is None:
+                continue
+            window, mask = filled
+            self.mask[window] |= mask
+            n_filled += 1
+
+        if n_filled == 0:
             raise GranuleNotFoundError
 
-        # OR all of the masks into one image, this ignores overlapping regions
-        self.mask = masks.any(axis=0)
         labelledImage = ski.measure.label(self.mask)
         labelledImage = segmentation.clear_border(labelledImage)
         return labelledImage
@@ -308,6 +365,14 @@ class GranuleDetector:
         largest granule size that is accepted, we perform another iterative step
         if it's too large.
 
+        Returns
+        -------
+
+        window: tuple[slice, slice]
+            The region of the image containing the granule.
+        mask: np.ndarray
+            Binary mask of the granule within ``window``.
+
         """
         min_intensity_lim = float(config("image_processing", "granule_minimum_intensity"))
 
@@ -331,7 +396,9 @@ class GranuleDetector:
         # Filter on the magnitude of the central point
         center_intensity = self.processed_image[x, y]
         # TODO: Scale this by the maximum intensity of the image
-        max_intensity = self.processed_image.max()
+        if not hasattr(self, "max_intensity"):
+            self.max_intensity = self.processed_image.max()
+        max_intensity = self.max_intensity
         if center_intensity < max_intensity * min_intensity_lim:
             return None
 
@@ -344,23 +411,58 @@ class GranuleDetector:
         else:
             raise ValueError("no granule detection method {}".format(method))
 
+        pixel_size = self.frame.pixel_size
+        if pixel_size == None:
+            pixel_size = 1
+        max_area = int(np.pi * self.max_size ** 2 / pixel_size ** 2)
+
         # First test
-        mask = ski.morphology.flood(
-            self.processed_image, (x, y), tolerance=tolerance, connectivity=1
-        )
+        window, mask = self._floodWindow(x, y, tolerance, max_area)
 
         area = mask.sum()
 
         # Filter out granules with areas which fall outside of the threshold range.
-        pixel_size = self.frame.pixel_size
-        if pixel_size == None:
-            pixel_size = 1
-        if area > int(np.pi * self.max_size ** 2 / pixel_size ** 2):
+        if area > max_area:
             return None
         if area < int(np.pi * self.min_size ** 2 / pixel_size ** 2):
             return None
 
-        return mask
+        return window, mask
+
+    def _floodWindow(self, x, y, tolerance, max_area):
+        """Flood fill from the point within a window around it.
+
+        The window starts just larger than the largest accepted granule, so the cost of
+        the fill depends on the size of the granule rather than the frame. If the fill
+        reaches the edge of the window then it may continue outside of it, in which case
+        the window is doubled in size. This is not needed once the fill is larger than
+        ``max_area``, as the granule is rejected regardless.
+
+        Returns the window, as a pair of slices, and the mask within the window. This is
+        identical to flood filling the whole image and cropping to the window.
+        """
+        height, width = self.processed_image.shape
+        half_width = int(np.ceil(np.sqrt(max(max_area, 1) / np.pi))) + 2
+
+        while True:
+            x_min, x_max = max(x - half_width, 0), min(x + half_width + 1, height)
+            y_min, y_max = max(y - half_width, 0), min(y + half_width + 1, width)
+            window = (slice(x_min, x_max), slice(y_min, y_max))
+
+            mask = ski.morphology.flood(
+                self.processed_image[window], (x - x_min, y - y_min), tolerance=tolerance, connectivity=1
+            )
+
+            # Only the edges of the window that are inside the image can clip the fill
+            clipped = (
+                (x_min > 0 and mask[0].any())
+                or (x_max < height and mask[-1].any())
+                or (y_min > 0 and mask[:, 0].any())
+                or (y_max < width and mask[:, -1].any())
+            )
+            if not clipped or mask.sum() > max_area:
+                return window, mask
+            half_width *= 2
 
     def _refineCentre(self, x, y, radius=2):
         """Find the brightest pixel within a small area of the point.
@@ -28,12 +28,13 @@ class Kernels:
 def apply_seperable_kernel(image, v_1, v_2):
     """ Apply a separable kernel G to an image where K = v_2 * v_1.
 
-    Namely, v_1 is applied to the image first. """
+    Namely, v_1 is applied to the image first. The kernel acts on the last two axes, so a
+    stack of images may be given. """
     output = np.zeros_like(image)
     filter_kwargs = dict(mode="reflect", cval=0, origin=0)
 
-    filters.correlate1d(image, v_1, 1, output, **filter_kwargs)
-    filters.correlate1d(output, v_2, 0, output, **filter_kwargs)
+    filters.correlate1d(image, v_1, -1, output, **filter_kwargs)
+    filters.correlate1d(output, v_2, -2, output, **filter_kwargs)
     return output
 
 fourth_order = Kernels(
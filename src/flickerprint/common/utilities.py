@@ -1,5 +1,21 @@
 #/bin/usr/python
 
+import hashlib
+import json
+from pathlib import Path
+
+from flickerprint.common.configuration import config
+
+# Compression codecs for the HDF5 files, mapped to the PyTables ``complib``
+HDF_COMPRESSION = {
+    "none": None,
+    "bzip2": "bzip2",
+    "zlib": "zlib",
+    "lz4": "blosc:lz4",
+    "zstd": "blosc:zstd",
+}
+
+
 def strtobool (val):
     """Convert a string representation of truth to true (1) or false (0).
 
@@ -16,4 +32,45 @@ def strtobool (val):
     elif val in ('n', 'no', 'f', 'false', 'off', '0'):
         return 0
     else:
-        raise ValueError("invalid truth value %r" % (val,))
\ No newline at end of file
+        raise ValueError("invalid truth value %r" % (val,))
+
+
+def hdf_compression() -> dict:
+    """Return the ``complib`` and ``complevel`` for writing HDF5 files with pandas.
+
+    These are taken from the ``compression`` and ``compression_level`` values in the
+    config file. Note that pandas only compresses the data if ``complevel`` is greater
+    than zero.
+    """
+    name = str(config("workflow", "compression")).lower()
+    if name not in HDF_COMPRESSION:
+        raise ValueError(f"Invalid compression: {name}. Choose one of {', '.join(HDF_COMPRESSION)}.")
+    level = int(config("workflow", "compression_level"))
+    if not 0 <= level <= 9:
+        raise ValueError(f"Invalid compression_level: {level}. This must be between 0 and 9.")
+
+    complib = HDF_COMPRESSION[name]
+    if complib is None:
+        return dict(complib=None, complevel=0)
+    return dict(complib=complib, complevel=level)
+
+
+def hdf_compression_label(compression: dict) -> str:
+    """ Describe the compression for the file attributes, e.g. ``zlib:1``. """
+    if compression["complib"] is None or not compression["complevel"]:
+        return "none"
+    return f"{compression['complib']}:{compression['complevel']}"
+
+
+def file_fingerprint(path: Path) -> dict:
+    """ Identify a file by its size and modification time, without reading it. """
+    stat = Path(path).stat()
+    return {"input_size": stat.st_size, "input_mtime": stat.st_mtime_ns}
+
+
+def config_hash(section: str, excluded=()) -> str:
+    """ Hash the values in a section of the config file, ignoring the ``excluded`` keys. """
+    values = {
+        key: str(config(section, key)) for key in config.defaults[section] if key not in excluded
+    }
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
@@ -20,6 +20,11 @@ We decompose this into fractions
    - A(q, l) = N_ql
    - B(l) = l(l+1)(l-1)(l+2)
    - C(l) = (l-1)(l+2)
+
+As kappa_bar only scales the whole spectrum, the log residuals for a fixed sigma_bar are
+minimised by taking log10(kappa_bar) as the mean of log10(S_q(sigma_bar) / F_q,exp), where
+S_q is the spectrum with kappa_bar = 1. ``profile_minimiser`` uses this to reduce the fit
+to a one dimensional search in sigma_bar.
 """
 
 from typing import Callable
@@ -27,7 +32,7 @@ from typing import Callable
 import numpy as np
 from scipy.special import factorial, lpmv
 from typing import Tuple
-from scipy.optimize import least_squares
+from scipy.optimize import least_squares, minimize_scalar
 
 
 class SpectrumFitterBuilder:
@@ -86,6 +91,158 @@ class SpectrumFitterBuilder:
             return np.sum(residual_vals**2, axis=-1)
         return residuals, fitting_error
 
+    def residual_jacobian(self, sigma_bar, kappa_bar) -> np.ndarray:
+        """Derivatives of the log residuals with respect to σ and κ, with shape (q_max-1, 2).
+
+        The residuals are log10(S_q(σ) / κ) - log10(F_q,exp), so the experimental spectrum
+        does not enter the derivatives. Arrays of ``sigma_bar`` and ``kappa_bar`` with
+        shape (N,) give a Jacobian of shape (N, q_max-1, 2).
+        """
+        denominator = self.b_l + self.c_l * np.asarray(sigma_bar, dtype=float)[..., None, None]
+        spectrum = (self.a_ql / denominator).sum(axis=-1)
+        d_spectrum = -(self.a_ql * self.c_l / denominator**2).sum(axis=-1)
+
+        d_kappa = -1.0 / (np.asarray(kappa_bar, dtype=float)[..., None] * np.log(10))
+        return np.stack(
+            [d_spectrum / (spectrum * np.log(10)), np.broadcast_to(d_kappa, spectrum.shape)], axis=-1
+        )
+
+    def _profile_error(self, sigma_bar, log_experimental: np.ndarray):
+        """The fitting error, and best log10(κ), for each σ with κ chosen analytically."""
+        sigma_bar = np.asarray(sigma_bar, dtype=float)
+        # The sum over l as a matrix product, which avoids building an array over (σ, q, l)
+        spectrum = (1.0 / (self.b_l + self.c_l * sigma_bar[..., None])) @ self.a_ql.T
+        log_ratio = np.log10(spectrum) - log_experimental
+        log_kappa = log_ratio.mean(axis=-1)
+        error = ((log_ratio - log_kappa[..., None]) ** 2).sum(axis=-1)
+        return error, log_kappa
+
+    def profile_minimiser(self, spectrum_experimental: np.ndarray, n_points: int = 25):
+        """Fit σ and κ by minimising over σ with the best κ for each σ.
+
+        A scan of ``n_points`` in log σ brackets the minimum, which is then refined with
+        Brent's method. The results are in the same form as ``minimiser``.
+        """
+        log_experimental = np.log10(np.abs(spectrum_experimental))
+        log_sigmas = np.linspace(-5, 7, n_points)
+        errors, _ = self._profile_error(10**log_sigmas, log_experimental)
+        best = int(np.argmin(errors))
+
+        lower, upper = log_sigmas[max(best - 1, 0)], log_sigmas[min(best + 1, n_points - 1)]
+        result = minimize_scalar(
+            lambda log_sigma: self._profile_error(10**log_sigma, log_experimental)[0],
+            bounds=(lower, upper),
+            method="bounded",
+            options={"xatol": 1e-10},
+        )
+        sigma_bar = 10**result.x
+
+        # The scan is in log σ, so check the lower bound of σ separately
+        if best == 0 and self._profile_error(0.0, log_experimental)[0] < result.fun:
+            sigma_bar = np.float64(0.0)
+
+        fitting_error, log_kappa = self._profile_error(sigma_bar, log_experimental)
+        fitting_error, kappa_bar = float(fitting_error), float(10**log_kappa)
+        if not np.isfinite(fitting_error):
+            return None
+
+        # Estimate the errors as ``minimiser`` does from the Jacobian of the residuals
+        jacobian = self.residual_jacobian(sigma_bar, kappa_bar)
+        pcov = np.linalg.inv(jacobian.T.dot(jacobian))
+        S_sq = fitting_error / (self.q_max - 2)
+        errors = np.sqrt(np.abs(np.diag(pcov * S_sq)))
+
+        return {
+            "sigma_bar": sigma_bar,
+            "sigma_bar_err": errors[0],
+            "kappa_scale": kappa_bar,
+            "kappa_scale_err": errors[1],
+            "fitting_error": fitting_error,
+        }
+
+    def batch_minimiser(
+        self, spectra_experimental: np.ndarray, n_points: int = 25, n_iterations: int = 50, chunk_size: int = 1024
+    ):
+        """Fit σ and κ for each row of ``spectra_experimental``, with shape (N, q_max-1).
+
+        This is ``profile_minimiser`` applied to every spectrum together: the scan in log σ
+        is shared by all of the spectra, and each bracket is then narrowed by a golden
+        section search of ``n_iterations`` steps, run as array operations over the
+        spectra. The spectra are fitted ``chunk_size`` at a time to limit the memory used.
+
+        Returns a dict of arrays with the same keys as ``minimiser``, which are NaN for the
+        spectra that could not be fitted.
+        """
+        log_experimental = np.log10(np.abs(np.atleast_2d(spectra_experimental)))
+        results = [
+            self._batch_profile_fit(log_experimental[start:start + chunk_size], n_points, n_iterations)
+            for start in range(0, max(len(log_experimental), 1), chunk_size)
+        ]
+        return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+    def _batch_profile_fit(self, log_experimental: np.ndarray, n_points: int, n_iterations: int):
+        """Fit a chunk of spectra for ``batch_minimiser``."""
+        log_sigmas = np.linspace(-5, 7, n_points)
+        # The grid spectra are the same for every granule, so are only calculated once
+        scan_errors, _ = self._profile_error(10**log_sigmas[:, None], log_experimental)
+        best = np.argmin(scan_errors, axis=0)
+        best_error = scan_errors[best, np.arange(len(best))]
+
+        def error(log_sigma):
+            return self._profile_error(10**log_sigma, log_experimental)[0]
+
+        lower, upper = log_sigmas[np.maximum(best - 1, 0)], log_sigmas[np.minimum(best + 1, n_points - 1)]
+        inv_phi = (np.sqrt(5) - 1) / 2
+        inner_lower, inner_upper = upper - inv_phi * (upper - lower), lower + inv_phi * (upper - lower)
+        error_lower, error_upper = error(inner_lower), error(inner_upper)
+        for _ in range(n_iterations):
+            # Keep the side of the bracket that contains the smaller of the two inner points
+            left = error_lower < error_upper
+            upper = np.where(left, inner_upper, upper)
+            lower = np.where(left, lower, inner_lower)
+            new_point = np.where(left, upper - inv_phi * (upper - lower), lower + inv_phi * (upper - lower))
+            new_error = error(new_point)
+            inner_lower, inner_upper, error_lower, error_upper = (
+                np.where(left, new_point, inner_upper),
+                np.where(left, inner_lower, new_point),
+                np.where(left, new_error, error_upper),
+                np.where(left, error_lower, new_error),
+            )
+        log_sigma = np.where(error_lower < error_upper, inner_lower, inner_upper)
+        sigma_bar = 10**log_sigma
+
+        # The scan is not guaranteed to bracket a single minimum, so keep the best scan point
+        # if it is better, and check the lower bound of σ separately as for ``profile_minimiser``
+        search_error = np.minimum(error_lower, error_upper)
+        sigma_bar = np.where(best_error < search_error, 10**log_sigmas[best], sigma_bar)
+        zero_error, _ = self._profile_error(np.zeros(len(sigma_bar)), log_experimental)
+        sigma_bar = np.where((best == 0) & (zero_error < np.minimum(best_error, search_error)), 0.0, sigma_bar)
+
+        fitting_error, log_kappa = self._profile_error(sigma_bar, log_experimental)
+        kappa_bar = 10**log_kappa
+
+        # The diagonal of the inverse of JᵀJ, as in ``profile_minimiser``, but written out for
+        # the 2 × 2 matrices so that a single singular matrix doesn't stop the whole batch
+        jacobian = self.residual_jacobian(sigma_bar, kappa_bar)
+        jtj = np.einsum("nqi,nqj->nij", jacobian, jacobian)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            determinant = jtj[:, 0, 0] * jtj[:, 1, 1] - jtj[:, 0, 1] ** 2
+            pcov_diag = np.stack([jtj[:, 1, 1], jtj[:, 0, 0]], axis=-1) / determinant[:, None]
+        S_sq = fitting_error / (self.q_max - 2)
+        errors = np.sqrt(np.abs(pcov_diag * S_sq[:, None]))
+
+        result = {
+            "sigma_bar": sigma_bar,
+            "sigma_bar_err": errors[:, 0],
+            "kappa_scale": kappa_bar,
+            "kappa_scale_err": errors[:, 1],
+            "fitting_error": fitting_error,
+        }
+        failed = ~np.isfinite(fitting_error)
+        for values in result.values():
+            values[failed] = np.nan
+        return result
+
     @classmethod
     def _get_constant_l_terms(cls, l_max: int = 60):
         """The constant terms on the denominator, given by B(l) above."""
@@ -123,10 +280,8 @@ class SpectrumFitterBuilder:
         kappa_values = np.logspace(-7, 5, n_points)
 
         ss, kk = np.meshgrid(sigma_values, kappa_values, indexing="ij")
-        value_array = np.stack([ss, kk])
-        fitting_error_array = np.apply_along_axis(
-            error_function, axis=0, arr=value_array
-        )
+        # ``get_spectra`` broadcasts over the grid, so the whole scan is a single call
+        fitting_error_array = error_function((ss, kk))
 
         # Trick to get the index of the ``k`` lowest elements, note they're not guaranteed to be ordered
         # This indexes into the flattened array, so we use this for the best sigma and kappa values
@@ -141,11 +296,24 @@ class SpectrumFitterBuilder:
         summary = np.stack([best_cost, best_sigma, best_kappa]).T
         return summary
 
-    def minimiser(self, residual_function: Callable, error_function: Callable, n_starting_points: int = 18, n_best_points: int = 3):
-        
+    def minimiser(
+        self, residual_function: Callable, error_function: Callable, n_starting_points: int = 18, n_best_points: int = 3,
+        analytic_jacobian: bool = False,
+    ):
+        """Fit σ and κ with ``least_squares``, starting from the best points of a grid scan.
+
+        By default the fit estimates the Jacobian by finite differences. If
+        ``analytic_jacobian`` is set, the fit uses ``residual_jacobian`` instead. This
+        changes the fitted values: most agree to about 1e-7, but the fit can stop at a
+        different point along a flat valley of the error, so a few percent of spectra have a
+        different σ and κ and a fitting error up to about 10% higher or lower.
+
+        The errors are always calculated from ``residual_jacobian`` at the fitted values.
+        """
         starting_points = self.grid_scan_points(
             error_function=error_function, n_points=n_starting_points, n_best_points=n_best_points
         )
+        jacobian = (lambda params: self.residual_jacobian(*params)) if analytic_jacobian else "2-point"
 
         best_fit_value = np.inf
         parameters = None
@@ -156,13 +324,15 @@ class SpectrumFitterBuilder:
             minimiser_result = least_squares(
                 fun=residual_function,
                 x0=x0,
+                jac=jacobian,
                 bounds = ([0.0,0.0], [np.inf, np.inf]),
             )
 
             if 2*minimiser_result["cost"] < best_fit_value: # The definition used in least_squares has a factor of 1/2 in it that we don't use in our minimisation.
                 best_fit_value = 2*minimiser_result["cost"]
                 parameters = minimiser_result["x"]
-                pcov = np.linalg.inv(minimiser_result["jac"].T.dot(minimiser_result["jac"]))
+                jacobian_fit = self.residual_jacobian(*parameters)
+                pcov = np.linalg.inv(jacobian_fit.T.dot(jacobian_fit))
 
                 S_sq = 2*minimiser_result["cost"] / (self.q_max-x0.size)
 
@@ -187,12 +357,24 @@ class SpectrumFitterBuilder_ST_Only(SpectrumFitterBuilder):
         self.q_max = q_max
         self.a_ql = self._get_numerator_factor(self.q_max, l_max)
         self.c_l = self._get_base_l_terms(l_max)
+        # The spectrum for σ = 1, every other spectrum is this divided by σ
+        self.unit_spectrum = (self.a_ql / self.c_l).sum(axis=-1)
 
 
     def get_spectra(self, sigma_bar: float):
-        """Calculate the given theoretical spectrum for the given σ and κ."""
+        """Calculate the given theoretical spectrum for the given σ and κ.
+
+        An array of ``sigma_bar`` with shape (N, 1, 1) gives spectra of shape (N, q_max-1).
+        """
         out = self.a_ql/(self.c_l * sigma_bar)
-        return out.sum(axis=1)
+        return out.sum(axis=-1)
+
+    def residual_jacobian(self, sigma_bar: float) -> np.ndarray:
+        """Derivatives of the log residuals with respect to σ, with shape (q_max-1, 1).
+
+        The spectrum is proportional to 1/σ, so each derivative is -1 / (σ ln 10).
+        """
+        return np.full((self.q_max - 1, 1), -1.0 / (sigma_bar * np.log(10)))
     
     def create_fitting_function(
         self, spectrum_experimental: np.ndarray
@@ -217,18 +399,21 @@ class SpectrumFitterBuilder_ST_Only(SpectrumFitterBuilder):
         Returns an array of shape (``n_best_points`` × 3) with the (fitting_error, sigma, kappa) values
         """
         sigma_values = np.logspace(-5, 7, n_points)
-        fitting_error_array = np.array([error_function(np.array([s])) for s in sigma_values])
+        fitting_error_array = error_function(sigma_values[:, None, None])
         best_indices = np.argpartition(fitting_error_array, n_best_points)[:n_best_points]
         best_sigma = sigma_values[best_indices]
         best_cost = fitting_error_array[best_indices]
         summary = np.stack([best_cost, best_sigma]).T
         return summary
 
-    def minimiser(self, residual_function: Callable, error_function: Callable, n_starting_points: int = 18, n_best_points: int = 3):
-        
+    def minimiser(
+        self, residual_function: Callable, error_function: Callable, n_starting_points: int = 18, n_best_points: int = 3,
+        analytic_jacobian: bool = False,
+    ):
         starting_points = self.grid_scan_points(
             error_function=error_function, n_points=n_starting_points, n_best_points=n_best_points
         )
+        jacobian = (lambda params: self.residual_jacobian(*params)) if analytic_jacobian else "2-point"
 
         best_fit_value = np.inf
         parameters = None
@@ -239,13 +424,15 @@ class SpectrumFitterBuilder_ST_Only(SpectrumFitterBuilder):
             minimiser_result = least_squares(
                 fun=residual_function,
                 x0=x0,
+                jac=jacobian,
                 bounds = ([0.0], [np.inf]),
             )
 
             if 2*minimiser_result["cost"] < best_fit_value:
                 best_fit_value = 2*minimiser_result["cost"]
                 parameters = minimiser_result["x"]
-                pcov = np.linalg.inv(minimiser_result["jac"].T.dot(minimiser_result["jac"]))
+                jacobian_fit = self.residual_jacobian(*parameters)
+                pcov = np.linalg.inv(jacobian_fit.T.dot(jacobian_fit))
 
                 S_sq = 2*minimiser_result["cost"] / (self.q_max-x0.size)
 
@@ -261,6 +448,30 @@ class SpectrumFitterBuilder_ST_Only(SpectrumFitterBuilder):
             "fitting_error_ST": best_fit_value,
         }
 
+    def exact_fit(self, spectra_experimental: np.ndarray):
+        """Fit σ exactly for each row of ``spectra_experimental``, with shape (N, q_max-1).
+
+        The log residuals are log10(S_q) - log10(σ) - log10(F_q,exp), where S_q is the
+        ``unit_spectrum``, so the least squares value of log10(σ) is the mean of
+        log10(S_q / F_q,exp). The errors are calculated as in ``minimiser``, using
+        ``residual_jacobian``.
+
+        Returns a dict of arrays with the same keys as ``minimiser``.
+        """
+        log_ratio = np.log10(self.unit_spectrum) - np.log10(np.abs(spectra_experimental))
+        log_sigma = log_ratio.mean(axis=-1)
+        fitting_error = ((log_ratio - log_sigma[..., None]) ** 2).sum(axis=-1)
+        sigma_bar = 10**log_sigma
+
+        n_orders = log_ratio.shape[-1]
+        pcov = (sigma_bar * np.log(10)) ** 2 / n_orders
+        S_sq = fitting_error / (self.q_max - 1)
+        return {
+            "sigma_ST_bar": sigma_bar,
+            "sigma_ST_bar_err": np.sqrt(np.abs(pcov * S_sq)),
+            "fitting_error_ST": fitting_error,
+        }
+
 
 def _numerator_factor(q_vec: np.ndarray, l_vec: np.ndarray):
     ll, qq = np.meshgrid(l_vec, q_vec, indexing="ij")
@@ -287,8 +498,9 @@ def _norm_vec(l, q):
 def calculate_durbin_watson(
     experimental_spectrum: np.ndarray, best_fit_spectrum: np.ndarray
 ):
+    """The Durbin-Watson statistic of the log residuals, for each row of 2D arrays of spectra."""
     residuals = np.log10(experimental_spectrum / best_fit_spectrum)
-    durbin_watson_stat = np.sum(np.square(residuals[1:] - residuals[:1])) / np.sum(
-        np.square(residuals)
+    durbin_watson_stat = np.sum(np.square(residuals[..., 1:] - residuals[..., :-1]), axis=-1) / np.sum(
+        np.square(residuals), axis=-1
     )
     return durbin_watson_stat
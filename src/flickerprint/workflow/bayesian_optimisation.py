@@ -539,7 +539,7 @@ def get_images_for_BO(experiment_dir, n_samples, n_frames_per_sample, method, se
     
     l_frames_in_images = []
     for e, im_path in enumerate(l_images):
-        gen_image = fg.bioformatsGen(Path(im_path))
+        gen_image = fg.gen_opener(Path(im_path))
         first_frame = next(gen_image)
         n_frames = first_frame.total_frames
 
@@ -39,6 +39,7 @@ import platform
 import h5py
 import os
 import warnings
+import zipfile
 import numpy as np
 import pandas as pd
 import pickle as pkl
@@ -50,18 +51,33 @@ from functools import partial
 from time import sleep
 from matplotlib.ticker import MaxNLocator
 
-from flickerprint.common.utilities import strtobool
+from flickerprint.common.utilities import (
+    config_hash, file_fingerprint, hdf_compression, hdf_compression_label, strtobool
+)
+import flickerprint.common.boundary_extraction as be
 import flickerprint.fluctuation.spectra as sf
 import flickerprint.version as version
 import flickerprint.tools.plot_tools as pt
+import flickerprint.workflow.scheduling as scheduling
 from flickerprint.common.configuration import config
 
 
-def process_fourier_file(fourier_path: Path, output: Path, plotting: bool=False, _pbar_pos: int = 0):
+def process_fourier_file(
+    fourier_path: Path, output: Path, plotting: bool=False, _pbar_pos: int = 0, granule_workers: int = 1
+):
     """
     Perform the spectrum fitting on one .h5 file corresponding to one time series image.
     ====================================================================================
 
+    The Fourier terms of the whole file are first reduced to a matrix of experimental
+    spectra, with one row per granule, and a table of metadata, so that the fitting only
+    works with arrays.
+
+    If ``granule_workers`` is greater than one, the spectra are fitted in chunks on a
+    pool of that many processes. This cannot be used from within a ``multiprocessing.Pool``
+    worker. The ``batch`` fitting method fits all of the spectra together in the calling
+    process, so ``granule_workers`` is not used.
+
     Returns:
       - ``property_df``: one line per granule including sigma/kappa estimates
       - ``magnitude_df``: one line per order per granule, contains the fluctuation/fixed spectrum
@@ -75,130 +91,97 @@ def process_fourier_file(fourier_path: Path, output: Path, plotting: bool=False,
     temperature = float(config("spectrum_fitting", "temperature")) + 273.15
     max_order = int(config("spectrum_fitting", "fitting_orders"))
     spectrum_type = str(config("spectrum_fitting", "experimental_spectrum"))
+    fitting_method = str(config("spectrum_fitting", "fitting_method"))
+    analytic_jacobian = bool(strtobool(config("spectrum_fitting", "analytic_jacobian")))
+    if spectrum_type not in ("direct", "corrected"):
+        raise ValueError(f"Invalid spectrum type: {spectrum_type}. Choose either 'direct' or 'corrected'.")
+    if fitting_method not in ("least_squares", "profile", "batch"):
+        raise ValueError(
+            f"Invalid fitting method: {fitting_method}. Choose either 'least_squares', 'profile' or 'batch'."
+        )
+    if max_order > frame_info["max_order"]:
+        raise ValueError(
+            f"fitting_orders is {max_order}, but {fourier_path} only stores the orders up to "
+            f"{frame_info['max_order']}. Reduce fitting_orders, or increase max_stored_order "
+            "and run process-image again."
+        )
 
-    # Take ownership of the filtered array to stop warnings
-    fourier_terms = fourier_terms.query(f"order <= {max_order}").copy()
-    fourier_terms["mag_abs"] = np.abs(fourier_terms["magnitude"])
-    fourier_terms["mag_squared"] = fourier_terms["mag_abs"] ** 2
+    fourier_terms = fourier_terms.query(f"order <= {max_order}")
+    magnitude_df = aggregate_spectra(fourier_terms, spectrum_type, frame_info["input_path"])
 
-    grouped_by_granule = fourier_terms.groupby("granule_id")
+    # One row per granule and one column per order
+    spectra = magnitude_df.pivot(index="granule_id", columns="order", values="experiment_spectrum")
+    empty = (spectra**2).sum(axis=1) < 1e-20
+    if empty.any():
+        logging.debug(f"Skipping {empty.sum()} spectra as all values zero")
+        spectra = spectra[~empty]
+        magnitude_df = magnitude_df[magnitude_df["granule_id"].isin(spectra.index)].reset_index(drop=True)
+    granule_ids = spectra.index.to_numpy()
+    spectra_matrix = spectra.to_numpy()
 
     spectrum_builder = sf.SpectrumFitterBuilder(q_max=max_order, l_max=75)
     ST_only_builder = sf.SpectrumFitterBuilder_ST_Only(q_max=max_order, l_max=75)
 
-    property_df = []
-    magnitude_df = []
-
-    for granule_id, granule in tqdm(grouped_by_granule, position=_pbar_pos, unit="condensates", desc=f"#{_pbar_pos+1}"):
-        metadata = gather_granule_metadata(granule)
-
-        # Create a DF of the time averaged terms
-        # This is the experimental spectrum that we compare against
-        # We have to do the latter term using λ as otherwise it uses a cython version
-        # without complex support.
-        mag_df = granule.groupby(by="order").agg(
-            mag_squ_mean=("mag_squared", "mean"),
-            mag_mean=("magnitude", lambda x: np.mean(x)),
-        )
-        mag_df.reset_index(inplace=True)
-
-        # Supplementary columns used in Pécréaux 2004
-        # These terms differ from the definition in the paper as we take
-        # |〈mag〉|**2 rather than 〈|mag|〉**2
-        mag_df["fixed_squ"] = np.abs(mag_df["mag_mean"]) ** 2
-        mag_df["fluct_squ"] = mag_df["mag_squ_mean"] - mag_df["fixed_squ"]
-        if spectrum_type == 'direct':
-            mag_df['experiment_spectrum'] = mag_df["mag_squ_mean"]
-        elif spectrum_type == 'corrected':
-            mag_df["experiment_spectrum"] = mag_df["fluct_squ"]
-        else:
-            raise ValueError(f"Invalid spectrum type: {spectrum_type}. Choose either 'direct' or 'corrected'.")
-        experimental_spectrum = mag_df["experiment_spectrum"].values
-
-        spectrum_total = (experimental_spectrum**2).sum()
-        if spectrum_total < 1e-20:
-            logging.debug(f"Skipping spectrum as all values zero: {spectrum_total}")
-            continue
-
-        mag_df["granule_id"] = granule_id
-        mag_df["figure_path"] = frame_info["input_path"]
-        magnitude_df.append(mag_df)
-
-        # try:
-        residuals, minimisation_function = spectrum_builder.create_fitting_function(experimental_spectrum) # We need to do this one separately as it is needed for plotting.
-        fitting_result = spectrum_builder.minimiser(residuals, minimisation_function)
-        if fitting_result is None:
-            continue
-        ST_only_fitting_result = ST_only_builder.minimiser(
-            *ST_only_builder.create_fitting_function(experimental_spectrum))
-        # except ValueError:
-        #     continue
-
-        mag_df['best_fit'] = spectrum_builder.get_spectra(
-            fitting_result['sigma_bar'], fitting_result['kappa_scale']
-        )
-        durbin_watson = sf.calculate_durbin_watson(
-            experimental_spectrum, mag_df['best_fit']
-        )
-
-        fitting_result["granule_id"] = granule_id
-        fitting_result["durbin_watson"] = durbin_watson
-        fitting_result["q_2_mag"] = mag_df["fixed_squ"][0]
-        fitting_result["experiment"] = config("workflow", "experiment_name")
-        fitting_result |= metadata
-        fitting_result["image_path"] = str(granule["im_path"].iloc[0])
-
-        # Caluclate whether the spectrum is above the pixel threshold
-        pixel_threshold = (pixel_size/15)**2/fitting_result["mean_radius"]**2
-        fitting_result["above_res_threshold"] = (mag_df["experiment_spectrum"] > pixel_threshold).sum() > (len(mag_df["experiment_spectrum"]) / 2)
-        fitting_result["pass_count"] = granule[granule['order'] == 2]['valid'].sum()
-        fitting_result["pass_rate"] = fitting_result["pass_count"] / len(granule[granule['order'] == 2])
-
-
-        fitting_result["sigma"] = (
-            fitting_result["sigma_bar"]
-            / (fitting_result["mean_radius"]*1e-6) ** 2
-            * fitting_result["kappa_scale"]
-            * kB
-            * temperature
+    if fitting_method == "batch":
+        fitting_results = spectrum_builder.batch_minimiser(spectra_matrix)
+    else:
+        fitting_results = _fit_spectra(
+            spectra_matrix, spectrum_builder, fitting_method, analytic_jacobian, granule_workers, _pbar_pos
         )
-        fitting_result["sigma_st"] = ST_only_fitting_result["sigma_ST_bar"] / (fitting_result["mean_radius"]*1e-6) ** 2 * kB * temperature
-
-        fitting_result["sigma_err"] = fitting_result['sigma'] * np.sqrt((fitting_result['sigma_bar_err']/fitting_result['sigma_bar'])**2 + (fitting_result['kappa_scale_err']/fitting_result['kappa_scale'])**2)
-        fitting_result["sigma_err_st"] = ST_only_fitting_result['sigma_ST_bar_err']/ST_only_fitting_result['sigma_ST_bar'] * fitting_result['sigma_st']
-        fitting_result["fitting_diff"] = ST_only_fitting_result["fitting_error_ST"] - fitting_result["fitting_error"]
-
-        save_name = Path(frame_info["input_path"]).stem + f"--G{granule_id:02d}.png"
-        fitting_result['figure_path'] = save_name
-        if plotting :
-            
-            n_kappa, n_sigma = 100, 100
-            sigma_mid, kappa_mid  = 10e1,10e-1
-            width = 1000000.0
-            line_func = np.linspace if width <= 5 else np.geomspace
-            sigma_bars = line_func(sigma_mid / width, sigma_mid * width, num=n_sigma)
-            kappa_scales = line_func(kappa_mid / width, kappa_mid * width, num=n_kappa)
-            plot_spectrum(
-                granule_mag_df=mag_df,
-                granule_fit_df=fitting_result,
-                resolution_threshold=pixel_threshold,
-                ax=None,
-                save_path=output / Path(f"fitting/spectra")/save_name,
-            )
-            plot_heatmap(save_path=output / Path(f"fitting/heatmaps")/save_name,
-                            mag_df=mag_df,
-                            error_function=minimisation_function,
-                            sigma_bars=sigma_bars,
-                            kappa_scales=kappa_scales,
-                            mean_radius=fitting_result['mean_radius'] * 1e-6,
-                            temperature=temperature)
 
-        property_df.append(fitting_result)
+    fitted = np.isfinite(fitting_results["fitting_error"])
+    if not fitted.any():
+        raise ValueError(f"No valid granules found in {fourier_path}")
+    granule_ids, spectra_matrix = granule_ids[fitted], spectra_matrix[fitted]
+    property_df = pd.DataFrame({key: values[fitted] for key, values in fitting_results.items()})
+    property_df["granule_id"] = granule_ids
+    property_df = property_df.join(gather_granule_metadata(fourier_terms), on="granule_id")
+
+    best_fit = spectrum_builder.get_spectra(
+        property_df["sigma_bar"].to_numpy()[:, None], property_df["kappa_scale"].to_numpy()[:, None]
+    ).reshape(spectra_matrix.shape)
+    best_fit_terms = pd.DataFrame(best_fit, index=granule_ids, columns=spectra.columns).stack()
+    magnitude_df["best_fit"] = best_fit_terms.reindex(
+        pd.MultiIndex.from_frame(magnitude_df[["granule_id", "order"]])
+    ).to_numpy()
+
+    fixed_spectra = magnitude_df.pivot(index="granule_id", columns="order", values="fixed_squ")
+    property_df["durbin_watson"] = sf.calculate_durbin_watson(spectra_matrix, best_fit)
+    property_df["q_2_mag"] = fixed_spectra.loc[granule_ids].iloc[:, 0].to_numpy()
+    property_df["experiment"] = config("workflow", "experiment_name")
+
+    # Caluclate whether the spectrum is above the pixel threshold
+    pixel_threshold = (pixel_size/15)**2/property_df["mean_radius"].to_numpy()**2
+    property_df["above_res_threshold"] = (
+        (spectra_matrix > pixel_threshold[:, None]).sum(axis=1) > (spectra_matrix.shape[1] / 2)
+    )
 
+    property_df["sigma"] = (
+        property_df["sigma_bar"]
+        / (property_df["mean_radius"]*1e-6) ** 2
+        * property_df["kappa_scale"]
+        * kB
+        * temperature
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        property_df["sigma_err"] = property_df['sigma'] * np.sqrt((property_df['sigma_bar_err']/property_df['sigma_bar'])**2 + (property_df['kappa_scale_err']/property_df['kappa_scale'])**2)
+
+    stem = Path(frame_info["input_path"]).stem
+    property_df["figure_path"] = [f"{stem}--G{granule_id:02d}.png" for granule_id in granule_ids]
+
+    # The surface tension only model has an exact solution, so fit every granule at once
+    ST_only_fitting_result = ST_only_builder.exact_fit(spectra_matrix)
+    property_df["sigma_st"] = ST_only_fitting_result["sigma_ST_bar"] / (property_df["mean_radius"]*1e-6) ** 2 * kB * temperature
+    property_df["sigma_err_st"] = ST_only_fitting_result['sigma_ST_bar_err']/ST_only_fitting_result['sigma_ST_bar'] * property_df['sigma_st']
+    property_df["fitting_diff"] = ST_only_fitting_result["fitting_error_ST"] - property_df["fitting_error"]
+
+    if plotting:
+        for index, granule_mag_df in magnitude_df[magnitude_df["granule_id"].isin(granule_ids)].groupby("granule_id"):
+            row = np.searchsorted(granule_ids, index)
+            _plot_granule(
+                granule_mag_df, property_df.iloc[row], pixel_threshold[row], spectrum_builder, output, temperature
+            )
 
-    property_df = pd.DataFrame(property_df)
-    if property_df.empty:
-        raise ValueError(f"No valid granules found in {fourier_path}")
     property_df.drop(columns=["sigma_bar", "sigma_bar_err"], inplace=True)
     # Just reorder the columns so that they're the same as the documentation
     property_df = property_df.loc[:, ["granule_id", 
@@ -228,19 +211,147 @@ def process_fourier_file(fourier_path: Path, output: Path, plotting: bool=False,
                                       "sigma_err_st",
                                       "above_res_threshold"
                               ]]
-    magnitude_df = pd.concat(magnitude_df, ignore_index=True)
     return property_df, magnitude_df
 
 
-def gather_granule_metadata(granule_df: pd.DataFrame) -> dict:
-    props = {}
+def aggregate_spectra(fourier_terms: pd.DataFrame, spectrum_type: str, input_path: str) -> pd.DataFrame:
+    """ Time average the Fourier terms of every granule in a single pass.
+
+    Returns a table with one row per granule and order. The ``experiment_spectrum`` is the
+    spectrum that we compare against, which is either the total or the fluctuating part.
+    """
+    magnitude = fourier_terms["magnitude"].to_numpy()
+    # The complex mean is taken from the means of the real and imaginary parts, so that
+    # every column can use the fast grouped mean
+    terms = pd.DataFrame({
+        "granule_id": fourier_terms["granule_id"].to_numpy(),
+        "order": fourier_terms["order"].to_numpy(),
+        "mag_squ_mean": np.abs(magnitude) ** 2,
+        "mag_real": magnitude.real,
+        "mag_imag": magnitude.imag,
+    })
+    mag_df = terms.groupby(["granule_id", "order"]).mean().reset_index()
+    mag_df.insert(3, "mag_mean", mag_df.pop("mag_real") + 1j * mag_df.pop("mag_imag"))
+
+    # Supplementary columns used in Pécréaux 2004
+    # These terms differ from the definition in the paper as we take
+    # |〈mag〉|**2 rather than 〈|mag|〉**2
+    mag_df["fixed_squ"] = np.abs(mag_df["mag_mean"]) ** 2
+    mag_df["fluct_squ"] = mag_df["mag_squ_mean"] - mag_df["fixed_squ"]
+    if spectrum_type == 'direct':
+        mag_df['experiment_spectrum'] = mag_df["mag_squ_mean"]
+    elif spectrum_type == 'corrected':
+        mag_df["experiment_spectrum"] = mag_df["fluct_squ"]
+    else:
+        raise ValueError(f"Invalid spectrum type: {spectrum_type}. Choose either 'direct' or 'corrected'.")
+
+    mag_df["figure_path"] = input_path
+    return mag_df.loc[:, [
+        "order", "mag_squ_mean", "mag_mean", "fixed_squ", "fluct_squ", "experiment_spectrum", "granule_id", "figure_path"
+    ]]
+
+
+def _fit_spectrum(spectrum: np.ndarray, spectrum_builder, fitting_method: str, analytic_jacobian: bool = False):
+    """ Fit a single experimental spectrum, returning None if the fit failed. """
+    if fitting_method == "profile":
+        return spectrum_builder.profile_minimiser(spectrum)
+    return spectrum_builder.minimiser(
+        *spectrum_builder.create_fitting_function(spectrum), analytic_jacobian=analytic_jacobian
+    )
 
+
+def _fit_spectra(
+    spectra: np.ndarray, spectrum_builder, fitting_method: str, analytic_jacobian: bool = False,
+    granule_workers: int = 1, _pbar_pos: int = 0,
+):
+    """ Fit each row of ``spectra`` in turn, optionally on a pool of ``granule_workers``.
+
+    Returns a dict of arrays with the keys of the fitting result, which are NaN where the
+    fit failed, as for ``SpectrumFitterBuilder.batch_minimiser``.
+    """
+    if granule_workers > 1:
+        chunk_results = _fit_spectra_parallel(spectra, spectrum_builder, fitting_method, analytic_jacobian, granule_workers)
+    else:
+        chunk_results = (
+            [_fit_spectrum(spectrum, spectrum_builder, fitting_method, analytic_jacobian)] for spectrum in spectra
+        )
+
+    results = []
+    progress_bar = tqdm(total=len(spectra), position=_pbar_pos, unit="condensates", desc=f"#{_pbar_pos+1}")
+    for chunk in chunk_results:
+        progress_bar.update(len(chunk))
+        results.extend(chunk)
+    progress_bar.close()
+
+    keys = ["sigma_bar", "sigma_bar_err", "kappa_scale", "kappa_scale_err", "fitting_error"]
+    return {key: np.array([np.nan if result is None else result[key] for result in results]) for key in keys}
+
+
+# The builder and fitting settings used by the granule workers, see ``_init_granule_worker``
+_granule_worker_state = None
+
+
+def _init_granule_worker(spectrum_builder, fitting_method: str, analytic_jacobian: bool):
+    """ Keep the builder in the worker, so that it is sent once rather than with each chunk. """
+    global _granule_worker_state
+    _granule_worker_state = (spectrum_builder, fitting_method, analytic_jacobian)
+
+
+def _fit_spectra_chunk(chunk: np.ndarray) -> list:
+    """ Fit the rows of a chunk of spectra in a granule worker. """
+    spectrum_builder, fitting_method, analytic_jacobian = _granule_worker_state
+    return [_fit_spectrum(spectrum, spectrum_builder, fitting_method, analytic_jacobian) for spectrum in chunk]
+
+
+def _fit_spectra_parallel(
+    spectra: np.ndarray, spectrum_builder, fitting_method: str, analytic_jacobian: bool, n_workers: int
+):
+    """ Fit the spectra in chunks on a pool of ``n_workers``, yielding the results of each chunk in order. """
+    # Several chunks per worker balances the load, while keeping the overhead per chunk small
+    chunk_size = max(1, int(np.ceil(len(spectra) / (n_workers * 8))))
+    chunks = [spectra[i:i + chunk_size] for i in range(0, len(spectra), chunk_size)]
+
+    context = mp.get_context("spawn")
+    with context.Pool(
+        processes=n_workers, initializer=_init_granule_worker, initargs=(spectrum_builder, fitting_method, analytic_jacobian)
+    ) as pool:
+        yield from pool.imap(_fit_spectra_chunk, chunks)
+
+
+def _plot_granule(mag_df: pd.DataFrame, fitting_result: pd.Series, pixel_threshold: float, spectrum_builder, output: Path, temperature: float):
+    """ Plot the spectrum and error heatmap of a single granule. """
+    n_kappa, n_sigma = 100, 100
+    sigma_mid, kappa_mid  = 10e1,10e-1
+    width = 1000000.0
+    line_func = np.linspace if width <= 5 else np.geomspace
+    sigma_bars = line_func(sigma_mid / width, sigma_mid * width, num=n_sigma)
+    kappa_scales = line_func(kappa_mid / width, kappa_mid * width, num=n_kappa)
+    save_name = fitting_result["figure_path"]
+    for plot_dir in ("spectra", "heatmaps"):
+        (output / "fitting" / plot_dir).mkdir(parents=True, exist_ok=True)
+    plot_spectrum(
+        granule_mag_df=mag_df,
+        granule_fit_df=fitting_result,
+        resolution_threshold=pixel_threshold,
+        ax=None,
+        save_path=output / Path(f"fitting/spectra")/save_name,
+    )
+    plot_heatmap(save_path=output / Path(f"fitting/heatmaps")/save_name,
+                    mag_df=mag_df,
+                    error_function=spectrum_builder.create_fitting_function(mag_df["experiment_spectrum"].values)[1],
+                    sigma_bars=sigma_bars,
+                    kappa_scales=kappa_scales,
+                    mean_radius=fitting_result['mean_radius'] * 1e-6,
+                    temperature=temperature)
+
+
+def gather_granule_metadata(fourier_terms: pd.DataFrame) -> pd.DataFrame:
+    """ The properties of every granule in the Fourier terms, indexed by ``granule_id``. """
     # Properties averaged across all frames
-    props["mean_radius"] = granule_df["mean_radius"].mean()
-    props["mean_intensity"] = granule_df["mean_intensity"].mean()
+    metadata = fourier_terms.groupby("granule_id")[["mean_radius", "mean_intensity"]].mean()
 
     # (Mostly) Unchanging parameters where we only need to consider the first frame
-    first_frame = granule_df.iloc[0]
+    first_frame = fourier_terms.drop_duplicates("granule_id").set_index("granule_id")
     keyword_list = [
         "x",
         "y",
@@ -251,13 +362,26 @@ def gather_granule_metadata(granule_df: pd.DataFrame) -> dict:
         "bbox_top",
     ]
     for keyword_ in keyword_list:
-        props[keyword_] = first_frame[keyword_]
+        metadata[keyword_] = first_frame[keyword_]
+    metadata["image_path"] = first_frame["im_path"].astype(str)
+
+    # The fraction of frames where the boundary of the granule passed the filters
+    second_order = fourier_terms[fourier_terms["order"] == 2].groupby("granule_id")["valid"]
+    metadata["pass_count"] = second_order.sum()
+    metadata["pass_rate"] = metadata["pass_count"] / second_order.size()
 
-    return props
+    return metadata
 
 
-def main(working_dir: Path, plotting=False, cores=1):
-    """ Merge multiple Fourier terms into a single file. """
+def main(working_dir: Path, plotting=False, cores=1, force=False):
+    """ Merge multiple Fourier terms into a single file.
+
+    The results of each Fourier file are kept in ``fitting/partial``, and these are
+    reused by later runs unless the Fourier file, the ``spectrum_fitting`` section of
+    the config file or the experiment name has changed, or ``force`` is set. The Fourier terms are written to
+    ``aggregate_fittings.h5`` as each file finishes, so that only the per-granule
+    properties are held in memory.
+    """
     print(f"\n================\nSpectrum Fitting\n================\n")
     working_dir = Path(working_dir)
     config.refresh(working_dir / "config.yaml")
@@ -272,36 +396,66 @@ def main(working_dir: Path, plotting=False, cores=1):
     if cores > os.cpu_count():
         cores = os.cpu_count()
         warnings.warn(f"Number of cores requested exceeds available cores. Only {os.cpu_count()} cores are available.", UserWarning)
-    if cores > len(input_paths):
-        cores = len(input_paths)
     if cores == 1:
         print(f"Using 1 core")
+    elif len(input_paths) == 1:
+        print(f"Using {cores} cores to fit the granules of a single image")
     else:
+        cores = min(cores, len(input_paths))
         print(f"Using {cores} cores")
     
     print(f"----------\n")
 
-    if len(input_paths) > 1:
-        with mp.Pool(processes=cores, maxtasksperchild=1) as pool:
-            args = []
-            for pbar_pos, file in enumerate(input_paths):
-                args.append((Path(file), Path(working_dir), plotting, pbar_pos))
-
-            frame_info = pool.starmap(process_fourier_file, args)
-    else:
-        if cores != 1:
-            print("Using 1 core as only a single image to be analysed.")
-        print(f"\n")
-        frame_info = [process_fourier_file(input_paths[0], working_dir, plotting, 0)]
-
-    aggregate_data, fourier_terms = zip(*frame_info)
-    aggregate_data = pd.concat(aggregate_data, ignore_index=True,)
-    fourier_terms = pd.concat(fourier_terms, ignore_index=True,)
     if str(config("workflow", "experiment_name")) != "experiment_name":
         save_path = working_dir / f"aggregate_fittings.h5"
     else:
         save_path = working_dir / "aggregate_fittings.h5"
-    _write_hdf(save_path, aggregate_data, fourier_terms)
+    writer = AggregateWriter(save_path)
+    # The per-granule properties are small, so these are kept in the order of the files
+    aggregate_data = [None] * len(input_paths)
+    failed_paths = []
+
+    args = []
+    for pbar_pos, file in enumerate(input_paths):
+        args.append((Path(file), Path(working_dir), plotting, pbar_pos, force))
+
+    if len(input_paths) > 1:
+        # The workers are spawned rather than forked, as a fork while the results are
+        # being written would share the lock on the aggregate file with the new worker
+        context = mp.get_context("spawn")
+        config_location = working_dir / "config.yaml"
+        with context.Pool(processes=cores, maxtasksperchild=1, initializer=_init_worker, initargs=(config_location,)) as pool:
+            # Fit the largest files first, writing the results as each file finishes
+            costs = [scheduling.file_cost(file) for file in input_paths]
+            labels = [str(file) for file in input_paths]
+            for index, partial_path in scheduling.run_longest_first(pool, fit_fourier_file, args, costs, labels):
+                if partial_path is None:
+                    failed_paths.append(input_paths[index])
+                    continue
+                aggregate_data[index], fourier_terms = load_partial_results(partial_path)
+                writer.append(fourier_terms)
+                del fourier_terms
+    else:
+        # If there is only one image, then share its granules between the cores
+        print(f"\n")
+        partial_path = fit_fourier_file(*args[0], granule_workers=cores)
+        if partial_path is None:
+            failed_paths.append(input_paths[0])
+        else:
+            aggregate_data[0], fourier_terms = load_partial_results(partial_path)
+            writer.append(fourier_terms)
+
+    aggregate_data = [data for data in aggregate_data if data is not None]
+    if not aggregate_data:
+        writer.close(None)
+        raise RuntimeError("None of the Fourier files could be fitted.")
+    writer.close(pd.concat(aggregate_data, ignore_index=True,))
+    if failed_paths:
+        failed_list = "\n".join(str(path) for path in failed_paths)
+        warnings.warn(
+            f"The following files could not be fitted and are missing from {save_path.name}:\n{failed_list}\n"
+            "Run spectrum-fitting again to retry these files, the other results will be reused."
+        )
     sleep(2)
     print("\n\n")
     if bool(strtobool(config("spectrum_fitting", "plot_spectra_and_heatmaps"))):
@@ -321,16 +475,165 @@ def main(working_dir: Path, plotting=False, cores=1):
     print(f"\nSpectrum fitting analysis complete\n----------------------------------\n")
 
 
+def _init_worker(config_location: Path):
+    """ Load the configuration in a spawned worker. """
+    config.refresh(config_location)
+
+
+def _partial_path(fourier_path: Path, working_dir: Path) -> Path:
+    """ Location of the results for a single Fourier file. """
+    return Path(working_dir) / "fitting" / "partial" / f"{Path(fourier_path).stem}.pkl"
+
+
+# Values that do not change the results of the fitting, plotting is checked separately
+_UNFINGERPRINTED_KEYS = ("plot_spectra_and_heatmaps",)
+
+
+def fitting_fingerprint(fourier_path: Path) -> dict:
+    """ Identify the Fourier file and the configuration used to fit it.
+
+    The experiment name is included as it is stored with the results of each granule.
+    """
+    return {
+        **file_fingerprint(fourier_path),
+        "config_hash": config_hash("spectrum_fitting", _UNFINGERPRINTED_KEYS),
+        "experiment_name": str(config("workflow", "experiment_name")),
+        "version": version.__version__,
+    }
+
+
+def _plots_exist(property_df: pd.DataFrame, working_dir: Path) -> bool:
+    """ Check that the spectrum and heatmap of every granule have been plotted.
+
+    The plots are zipped at the end of ``main``, so both the directories and the zip
+    files are checked.
+    """
+    for plot_dir in ("spectra", "heatmaps"):
+        plot_path = Path(working_dir) / "fitting" / plot_dir
+        plotted = {path.name for path in plot_path.glob("*.png")}
+        zip_path = plot_path.with_suffix(".zip")
+        if zip_path.exists():
+            with zipfile.ZipFile(zip_path) as archive:
+                plotted.update(Path(name).name for name in archive.namelist())
+        if not set(property_df["figure_path"]) <= plotted:
+            return False
+    return True
+
+
+def fit_fourier_file(
+    fourier_path: Path, working_dir: Path, plotting: bool = False, _pbar_pos: int = 0, force: bool = False,
+    granule_workers: int = 1,
+):
+    """ Fit a Fourier file, saving the results so that they can be reused by later runs.
+
+    Returns the path to the results, or None if the file could not be fitted. The
+    results are only reused if the fingerprint of the Fourier file and configuration
+    matches, and, when ``plotting``, the plots of every granule exist, unless ``force``
+    is set.
+    """
+    partial_path = _partial_path(fourier_path, working_dir)
+    fingerprint = fitting_fingerprint(fourier_path)
+    if not force and partial_path.exists():
+        try:
+            with open(partial_path, "rb") as file:
+                saved = pkl.load(file)
+            if saved["fingerprint"] == fingerprint:
+                if not plotting or _plots_exist(saved["aggregate_data"], working_dir):
+                    print(f"#{_pbar_pos+1} Reusing the results for {fourier_path}")
+                    return partial_path
+                print(f"#{_pbar_pos+1} Fitting {fourier_path} again, as the plots are missing")
+        except Exception:
+            pass
+
+    try:
+        property_df, magnitude_df = process_fourier_file(fourier_path, working_dir, plotting, _pbar_pos, granule_workers)
+    except Exception as e:
+        print(f"\nUnable to fit {fourier_path}: {e}")
+        return None
+
+    # Write to a temporary file first so that an interrupted write is never reused
+    partial_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = partial_path.with_name(partial_path.name + ".tmp")
+    with open(temp_path, "wb") as file:
+        pkl.dump(
+            {"fingerprint": fingerprint, "aggregate_data": property_df, "fourier_terms": magnitude_df},
+            file=file,
+        )
+    os.replace(temp_path, partial_path)
+    return partial_path
+
+
+def load_partial_results(partial_path: Path):
+    """ Read the ``(aggregate_data, fourier_terms)`` saved by ``fit_fourier_file``. """
+    with open(partial_path, "rb") as file:
+        results = pkl.load(file)
+    return results["aggregate_data"], results["fourier_terms"]
+
+
+class AggregateWriter:
+    """ Write the results of the spectrum fitting as each Fourier file is finished.
+
+    The ``fourier_terms`` are appended to the file as a table, while the per-granule
+    ``aggregate_data`` is written on ``close``, along with the metadata. On Apple Silicon,
+    where writing HDF5 files can fail, the terms are instead held in memory and saved by
+    ``_write_hdf``.
+    """
+
+    def __init__(self, save_path: Path, compression: dict = None):
+        self.save_path = Path(save_path)
+        self.compression = hdf_compression() if compression is None else compression
+        self.n_rows = 0
+
+        self.streaming = not (platform.system() == "Darwin" and "ARM64" in platform.version())
+        self._started = False
+        self._held_terms = []
+
+    def append(self, fourier_terms: pd.DataFrame):
+        """ Add the Fourier terms of one file, continuing the index from the previous file. """
+        fourier_terms = fourier_terms.set_axis(pd.RangeIndex(self.n_rows, self.n_rows + len(fourier_terms)))
+        self.n_rows += len(fourier_terms)
+        if not self.streaming:
+            self._held_terms.append(fourier_terms)
+            return
+
+        mode = "a" if self._started else "w"
+        with pd.HDFStore(self.save_path, mode=mode, **self.compression) as store:
+            # Strings are fixed width in the table, so leave space for longer file names
+            store.append("fourier_terms", fourier_terms, format="table", index=False, min_itemsize={"figure_path": 255})
+        self._started = True
+
+    def close(self, aggregate_data: pd.DataFrame):
+        """ Write the ``aggregate_data`` and metadata, or just close the file if this is None. """
+        if not self.streaming:
+            if aggregate_data is not None:
+                _write_hdf(self.save_path, aggregate_data, pd.concat(self._held_terms))
+            self._held_terms = []
+            return
+
+        if aggregate_data is None:
+            return
+
+        aggregate_data.to_hdf(self.save_path, key="aggregate_data", mode="a", **self.compression)
+        print(f"\nAggregate fittings file location: aggregate_fittings.h5")
+        with h5py.File(self.save_path, "a") as f:
+            aggregate_hdf = f["aggregate_data"]
+            config_yaml, _ = config._aggregate_all()
+            aggregate_hdf.attrs['config'] = config_yaml
+            aggregate_hdf.attrs['version'] = version.__version__
+            aggregate_hdf.attrs['compression'] = hdf_compression_label(self.compression)
+
+
 def _write_hdf(
     save_path: Path, aggregate_data: pd.DataFrame, fourier_terms: pd.DataFrame
 ):
     """ Write the dataframe to HDF5 along with metadata. """
+    compression = hdf_compression()
     if platform.system()=="Darwin" and "ARM64" in platform.version():
         # Doing it this way will ensure we still catch Apple Silicon Macs even when using Rosetta 2.
         # The 'else' case below should catch all other platforms where writing to hdf5 should work normally.
         try:
-            aggregate_data.to_hdf(save_path, key="aggregate_data", mode="w")
-            fourier_terms.to_hdf(save_path, key="fourier_terms", mode="a")
+            aggregate_data.to_hdf(save_path, key="aggregate_data", mode="w", **compression)
+            fourier_terms.to_hdf(save_path, key="fourier_terms", mode="a", **compression)
             print(f"\nAggregate fittings file location: aggregate_fittings.h5")
 
             with h5py.File(save_path, "a") as f:
@@ -338,6 +641,7 @@ def _write_hdf(
                 config_yaml, _ = config._aggregate_all()
                 aggregate_hdf.attrs['config'] = config_yaml
                 aggregate_hdf.attrs['version'] = version.__version__
+                aggregate_hdf.attrs['compression'] = hdf_compression_label(compression)
         except:
             config_yaml, config_summary = config._aggregate_all()
             with open(f'{str(save_path)[:-3]}.pkl', 'wb') as file:
@@ -345,8 +649,8 @@ def _write_hdf(
             print(f"\nAggregate fittings file location: aggregate_fittings.pkl")
 
     else:
-        aggregate_data.to_hdf(save_path, key="aggregate_data", mode="w")
-        fourier_terms.to_hdf(save_path, key="fourier_terms", mode="a")
+        aggregate_data.to_hdf(save_path, key="aggregate_data", mode="w", **compression)
+        fourier_terms.to_hdf(save_path, key="fourier_terms", mode="a", **compression)
         print(f"\nAggregate fittings file location: aggregate_fittings.h5")
 
         with h5py.File(save_path, "a") as f:
@@ -354,28 +658,48 @@ def _write_hdf(
             config_yaml, _ = config._aggregate_all()
             aggregate_hdf.attrs['config'] = config_yaml
             aggregate_hdf.attrs['version'] = version.__version__
+            aggregate_hdf.attrs['compression'] = hdf_compression_label(compression)
 
 
 
 def load_fourier_terms(fourier_path: Path) -> pd.DataFrame:
-    """ Read the Fourier terms from file. """
+    """ Read the Fourier terms from file.
 
-    if fourier_path.name.endswith(".h5"):
-        fourier_terms = pd.read_hdf(fourier_path, key="fourier", mode="r")
+    The terms are returned in the long format, with one row per granule, frame and order.
+    Files are either written in the wide format, under the ``granules`` key, or by older
+    versions in the long format, under the ``fourier`` key.
+    """
 
+    if fourier_path.name.endswith(".h5"):
         with h5py.File(fourier_path, "r") as f:
-            attrs = f["fourier"].attrs
-            frame_info = dict(
-                input_path=attrs["input_path"], pixel_size=attrs["pixel_size"]
-            )
-            config_old = attrs["config"]
-            version_old = attrs["version"]
+            key = "granules" if "granules" in f else "fourier"
+            attrs = dict(f[key].attrs)
+
+        if key == "granules":
+            wide_table = pd.read_hdf(fourier_path, key=key, mode="r")
+            fourier_terms = be.wide_to_long(wide_table, attrs["orders"], attrs["im_path"])
+        else:
+            fourier_terms = pd.read_hdf(fourier_path, key=key, mode="r")
+
+        # Files written before the stored orders were configurable have no limit stored
+        max_order = attrs["max_order"] if "max_order" in attrs else fourier_terms["order"].max()
+        frame_info = dict(
+            input_path=attrs["input_path"], pixel_size=attrs["pixel_size"], max_order=int(max_order)
+        )
+        config_old = attrs["config"]
+        version_old = attrs["version"]
+        # Files written before the Fourier terms were streamed have no flag
+        complete = bool(attrs.get("complete", 1))
+        if not complete:
+            warnings.warn(f"Warning: process-image did not finish {fourier_path}, only part of the image is included")
     elif fourier_path.name.endswith(".pkl"):
         file = open(f'{str(fourier_path)}', 'rb')
         f = pkl.load(file=file)
         fourier_terms = f['fourier']
+        max_order = f['frame_data'].get("max_order", fourier_terms["order"].max())
         frame_info = dict(
-                input_path=f['frame_data']["input_path"], pixel_size=f['frame_data']["pixel_size"]
+                input_path=f['frame_data']["input_path"], pixel_size=f['frame_data']["pixel_size"],
+                max_order=int(max_order),
             )
         config_old = f['config']
         version_old = f['version']
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+""" Analyse the frames of a single microscope image on several cores.
+
+Outline
+-------
+
+The frames of a microscope file can only be read in order by one process, however the
+granule detection and boundary drawing for each frame are independent of each other.
+Only the linking of the granules between frames must be done in order.
+
+``ParallelFrameAnalyser`` reads the frames in the calling process and copies them into a
+ring of slots in shared memory. Worker processes take the next filled slot, analyse the
+frame in place and return the result. The results are then released in frame order, so
+that the caller can link the granules exactly as it would for the serial analysis.
+
+Notes
+-----
+
+- The workers are started with ``spawn`` as the reading process may hold the javaVM or a
+  reading thread, neither of which survive a ``fork``.
+- Results are pickled by the worker before the slot is released, as any arrays in the
+  result may be views into the shared frame.
+- Daemonic processes cannot have children, so this cannot be used from within the
+  ``multiprocessing.Pool`` used to process a directory of images.
+
+"""
+
+import multiprocessing as mp
+import pickle
+import queue
+from collections import deque
+from dataclasses import fields
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+import flickerprint.common.frame_gen as fg
+import flickerprint.common.granule_locator as gl
+from flickerprint.common.configuration import config
+
+
+class ParallelFrameAnalyser:
+    """Analyse frames in worker processes and return the results in frame order.
+
+    Parameters
+    ----------
+
+    image_frames: Iterable[MicroscopeFrame]
+        The frames to analyse, typically from ``frame_gen.gen_opener``.
+    analyse: Callable[[MicroscopeFrame, Path], object]
+        A module level function that analyses a single frame. If this raises a
+        ``GranuleNotFoundError`` then the result of the frame is None.
+    n_workers: int
+        Number of worker processes.
+    output_dir: Path
+        Experiment directory, this is passed to ``analyse`` and used to load the
+        configuration in the workers.
+
+    Iterating over this object yields ``(frame, result)`` pairs in frame order, where the
+    ``frame`` has no image data attached.
+
+    """
+
+    def __init__(self, image_frames, analyse, n_workers: int, output_dir: Path, slots_per_worker: int = 2):
+        if n_workers < 1:
+            raise ValueError(f"At least one worker is required, currently {n_workers}")
+        self._image_frames = iter(image_frames)
+        self._analyse = analyse
+        self.n_workers = n_workers
+        self.n_slots = n_workers * slots_per_worker
+        self.output_dir = Path(output_dir)
+
+        self._context = mp.get_context("spawn")
+        self._workers = []
+        self._shm = None
+        self._ring = None
+        self._task_queue = None
+        self._result_queue = None
+
+    def __iter__(self):
+        try:
+            yield from self._run()
+        finally:
+            self.close()
+
+    def _run(self):
+        """ Dispatch frames to the workers and yield the results in order. """
+        free_slots = list(range(self.n_slots))
+        # Frames that have been dispatched, in the order they were read
+        dispatched = deque()
+        finished = {}
+        frames_exhausted = False
+
+        while dispatched or not frames_exhausted:
+            # Keep all of the slots filled while there are frames left to read
+            while free_slots and not frames_exhausted:
+                try:
+                    frame = next(self._image_frames)
+                except StopIteration:
+                    frames_exhausted = True
+                    break
+                self._dispatch(frame, free_slots.pop())
+                dispatched.append(_strip_frame(frame))
+
+            if not dispatched:
+                continue
+            if dispatched[0].frame_num in finished:
+                frame = dispatched.popleft()
+                yield frame, finished.pop(frame.frame_num)
+                continue
+
+            frame_num, slot, payload = self._get_result()
+            free_slots.append(slot)
+            result = pickle.loads(payload)
+            if isinstance(result, Exception):
+                raise result
+            finished[frame_num] = result
+
+    def _dispatch(self, frame: fg.MicroscopeFrame, slot: int):
+        """ Copy the frame into shared memory and queue it for analysis. """
+        if self._shm is None:
+            self._start(frame.im_data.shape, frame.im_data.dtype)
+        if frame.im_data.shape != self._ring.shape[1:]:
+            raise ValueError(
+                f"Frame {frame.frame_num} has shape {frame.im_data.shape}, expected {self._ring.shape[1:]}"
+            )
+        self._ring[slot] = frame.im_data
+        self._task_queue.put((slot, _frame_metadata(frame)))
+
+    def _start(self, shape, dtype):
+        """ Allocate the shared ring of frames and start the workers. """
+        dtype = np.dtype(dtype)
+        ring_shape = (self.n_slots, *shape)
+        n_bytes = int(np.prod(ring_shape)) * dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(n_bytes, 1))
+        self._ring = np.ndarray(ring_shape, dtype=dtype, buffer=self._shm.buf)
+
+        self._task_queue = self._context.Queue()
+        self._result_queue = self._context.Queue()
+        config_location = self.output_dir / "config.yaml"
+        for _ in range(self.n_workers):
+            worker = self._context.Process(
+                target=_frame_worker,
+                args=(
+                    self._shm.name, ring_shape, dtype.str, self._task_queue,
+                    self._result_queue, self._analyse, self.output_dir, config_location,
+                ),
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _get_result(self):
+        """ Wait for the next result, failing if a worker has died. """
+        while True:
+            try:
+                return self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if any(worker.exitcode not in (None, 0) for worker in self._workers):
+                    raise RuntimeError("A frame worker exited unexpectedly.")
+
+    def close(self):
+        """ Stop the workers and release the shared memory. """
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        if self._shm is not None:
+            self._ring = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def _frame_metadata(frame: fg.MicroscopeFrame) -> dict:
+    """ Return the fields of the frame, excluding the image data. """
+    return {field.name: getattr(frame, field.name) for field in fields(frame) if field.name != "im_data"}
+
+
+def _strip_frame(frame: fg.MicroscopeFrame) -> fg.MicroscopeFrame:
+    """ Return a copy of the frame without the image data, which lives in the ring. """
+    return fg.MicroscopeFrame(im_data=None, **_frame_metadata(frame))
+
+
+def _frame_worker(shm_name, ring_shape, dtype, task_queue, result_queue, analyse, output_dir, config_location):
+    """ Analyse frames from the shared ring until a None task is received. """
+    config.refresh(config_location)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray(ring_shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            slot, metadata = task
+            frame = fg.MicroscopeFrame(im_data=ring[slot], **metadata)
+            try:
+                result = analyse(frame, output_dir)
+            except gl.GranuleNotFoundError:
+                result = None
+            except Exception as err:
+                result = err
+            # Copy the result out of the ring before the slot can be reused
+            try:
+                payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as err:
+                payload = pickle.dumps(RuntimeError(f"Unable to return result of frame {metadata['frame_num']}: {err}"))
+            del frame, result
+            result_queue.put((metadata["frame_num"], slot, payload))
+    finally:
+        del ring
+        shm.close()
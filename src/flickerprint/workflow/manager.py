@@ -77,6 +77,14 @@ def parse_arguments():
         type=int,
         default=1,
         help="Number of cores to use for multiprocessing. Default is 1. Not required for single files.")
+    parser_process_image.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Process all images, including those with up to date Fourier files.")
+    parser_process_image.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue unfinished images from their last checkpoint.")
     
     parser_process_image.set_defaults(func=process_image.main)
 
@@ -95,6 +103,9 @@ def parse_arguments():
     parser_spectrum.add_argument(
         "-c", "--cores", type=int, default=1, help="Number of cores to use"
     )
+    parser_spectrum.add_argument(
+        "-f", "--force", action="store_true", help="Fit all files, rather than reusing earlier results."
+    )
     parser_spectrum.set_defaults(func=extract_physical_values.main)
 
     #
@@ -29,18 +29,45 @@ drawing, which is configured in the config file.
 We store all of the Fourier terms, into a ``.hdf5`` database, along with links
 to any images created and metadata for each frame.
 
+The Fourier terms are appended to the database as each frame is processed by
+``FourierWriter``, so the memory use does not grow with the length of the video and the
+frames processed before a crash are kept. The ``complete`` attribute of the file is only
+set once the whole image has been processed.
+
+Each file also stores a fingerprint of the microscope image (its size and modification
+time) and a hash of the ``image_processing`` section of the config file. When a directory
+is processed again, images whose complete Fourier file has a matching fingerprint, and was
+written by the same version, are skipped unless ``force`` is set.
+
+Every ``checkpoint_interval`` frames the state of the granule linking, the next frame
+and the number of rows written are saved next to the Fourier file. If the analysis is
+stopped, ``resume`` continues from the last checkpoint, giving the same granule IDs as an
+uninterrupted run. The checkpoint is removed once the image is complete.
+
 Multiprocessing
 ---------------
 
 The combination of multiprocessing and javabridge often lead to large memory leaks,
-particularly when initialising the worker pool. This means that only a single core can be used
-to analyse a single microscope image. However, the analysis is typically fast enough that only
-using a single core on a single microscope image is not a problem.
+particularly when initialising the worker pool. This means that each microscope image is only
+ever read by a single process, which owns the javaVM if one is needed; the analysis of its
+frames can still be shared between cores, as described below.
+
+TIFF and OME-TIFF files are read without the javabridge (see ``frame_gen.tiffGen``), so when
+none of the images require bioformats the worker processes are kept alive between images
+rather than being replaced after every file.
 
 Parallelisation can be achieved by passing a directory of images into main() and setting the 
 number of cores to use with the -c flag. This will analyse each image in a separate process 
 and save the results as normal. Resources are allocated dynamically so only the required number
-of cores are used, up to a maximum of the number specified with the -c flag.
+of cores are used, up to a maximum of the number specified with the -c flag. The images are
+started largest first (see ``scheduling.run_longest_first``) and the time taken for each image
+is reported as it finishes.
+
+When a single image is passed with more than one core, the frames of that image are instead
+shared between the cores using ``frame_parallel.ParallelFrameAnalyser``. The granule
+detection and boundary drawing (``analyse_frame``) are run in the worker processes, while
+the granules are linked between frames in the main process in frame order, so the tracking
+is identical to the serial analysis.
 
 """
 
@@ -58,11 +85,15 @@ import warnings
 import multiprocessing as mp
 from time import sleep
 
-from flickerprint.common.utilities import strtobool
+from flickerprint.common.utilities import (
+    config_hash, file_fingerprint, hdf_compression, hdf_compression_label, strtobool
+)
 import flickerprint.common.boundary_extraction as be
 import flickerprint.common.frame_gen as fg
 import flickerprint.common.granule_locator as gl
 import flickerprint.tools.plot_tools as pt
+from flickerprint.workflow.frame_parallel import ParallelFrameAnalyser
+import flickerprint.workflow.scheduling as scheduling
 from flickerprint.common.configuration import config
 import flickerprint.version as version
 
@@ -96,11 +127,22 @@ def parse_arguments():
         default=1,
         help="Number of cores to use for multiprocessing. Default is 1. Not required for single files.")
 
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Process all images, including those with up to date Fourier files.")
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue unfinished images from their last checkpoint.")
+
     args = parser.parse_args()
     return args
 
 def main(
-        input_image: Path = None, output_dir: Path = ".", quiet: bool = False, max_frame: int = None, cores = 1
+        input_image: Path = None, output_dir: Path = ".", quiet: bool = False, max_frame: int = None, cores = 1,
+        force: bool = False, resume: bool = False,
 ):
     """
     Takes an image or a directory of images and processes them to extract the granule boundaries and Fourier terms.
@@ -124,9 +166,18 @@ def main(
         The maximum number of frames to process. Default is `None` which processes all frames.
     
     cores: int
-        The number of cores to use for multiprocessing. Default is 1. Only required if a directory of images is provided.
+        The number of cores to use for multiprocessing. Default is 1. If a directory of images is provided, each image is analysed
+        on a separate core. If a single image is provided, the frames of the image are shared between the cores.
         If the number of cores requested exceeds the number of available cores, the number of available cores will be used instead.
 
+    force: bool
+        If True, process every image. Otherwise images that already have a complete Fourier file, created from the same
+        image file, ``image_processing`` configuration and version, are skipped. Default is `False`.
+
+    resume: bool
+        If True, unfinished images are continued from their last checkpoint, rather than from the first frame.
+        Default is `False`.
+
     Debugging images to show the location and boundary of the detected granules. These images are saved in the 'tracking' directory in the 'detection' and 'outline' subdirectories.
     Debugging images can be configured using the 'granule_images' parameter in the config file.
 
@@ -171,33 +222,55 @@ def main(
         if files == []:
             raise FileNotFoundError(f"No images found in {input_image} with the provided regex: {image_regex}")
 
+        # Debugging runs are always repeated, as the fingerprint does not include max_frame
+        n_found = len(files)
+        if not force and max_frame is None:
+            files = [file for file in files if not is_up_to_date(fourier_save_path(file, output_dir), file)]
+
         if cores > os.cpu_count():
             cores = os.cpu_count()
             warnings.warn(f"Number of cores requested exceeds available cores. Only {os.cpu_count()} cores are available.", UserWarning)
         if cores > len(files):
-            cores = len(files)
+            cores = max(len(files), 1)
         if cores == 1:
             print(f"Using 1 core")
         else:
             print(f"Using {cores} cores")
         
         print(f"Image directory: {str(input_image)}")
-        print(f"Number of images to process: {len(files)}\n")
-        
-        with mp.Pool(processes=cores, maxtasksperchild=1) as pool:
+        print(f"Number of images to process: {len(files)}")
+        if len(files) < n_found:
+            print(f"Skipping {n_found - len(files)} images with up to date Fourier files, use --force to process them again.")
+        print()
+
+        # The JVM cannot be restarted within a process, so workers that may have started it
+        # must be replaced after each image. Files read natively can share the workers.
+        maxtasksperchild = 1 if any(fg.requires_jvm(file) for file in files) else None
+        with mp.Pool(processes=cores, maxtasksperchild=maxtasksperchild) as pool:
             # This handles the multiprocessing stage.
             # Since the JVM is not thread safe, we need to analyse each image in it's own process. 
+            # The largest images are started first, so that they do not hold up the end of the analysis.
             args = []
             for pbar_bos, file in enumerate(files):
-                    args.append((Path(file), Path(output_dir), quiet, max_frame, pbar_bos))
-            pool.starmap(single_image_worker, args)
-            
+                    args.append((Path(file), Path(output_dir), quiet, max_frame, pbar_bos, 1, resume))
+            costs = [scheduling.image_cost(file) for file in files]
+            labels = [str(file) for file in files]
+            for _ in scheduling.run_longest_first(pool, single_image_worker, args, costs, labels, quiet):
+                pass
+
+    elif not force and max_frame is None and is_up_to_date(fourier_save_path(input_image, output_dir), input_image):
+        print(f"Fourier file for {input_image} is up to date, use --force to process it again.")
     else:
-        # If there is only one image, then just process it directly.
-        if cores != 1:
-            print("Using 1 core as only a single image to be analysed.")
+        # If there is only one image, then share the frames between the cores.
+        if cores > os.cpu_count():
+            cores = os.cpu_count()
+            warnings.warn(f"Number of cores requested exceeds available cores. Only {os.cpu_count()} cores are available.", UserWarning)
+        if cores == 1:
+            print(f"Using 1 core")
+        else:
+            print(f"Using {cores} cores to analyse the frames of a single image")
         print(f"\n")
-        process_single_image(input_image, output_dir, quiet, max_frame)
+        process_single_image(input_image, output_dir, quiet, max_frame, frame_workers=cores, resume=resume)
 
     if bool(strtobool(config("image_processing", "granule_images"))):
         # If the debug images are saved, zip them up at the end to make them easier to transfer.
@@ -226,7 +299,8 @@ def single_image_worker(*args):
 
 @fg.vmManager
 def process_single_image(
-    input_image: Path, output_dir: Path, quiet: bool = False, max_frame: int = None, _pbar_pos: int = 0
+    input_image: Path, output_dir: Path, quiet: bool = False, max_frame: int = None, _pbar_pos: int = 0,
+    frame_workers: int = 1, resume: bool = False,
 ):
     """
     Locates the granules in a single image and extracts the Fourier terms. The Fourier terms are written to a .h5 file in the 'fourier' directory.
@@ -249,6 +323,14 @@ def process_single_image(
     _pbar_pos: int
         (Internal use only) The position of the progress bar. Default is None. Only required for multiprocessing.
 
+    frame_workers: int
+        The number of processes used to analyse the frames. Default is 1, which analyses the frames in this process.
+        This cannot be used from within a ``multiprocessing.Pool`` worker.
+
+    resume: bool
+        If True, continue from the last checkpoint of an earlier, unfinished, analysis of this image. If there is no
+        usable checkpoint then the analysis starts from the first frame. Default is False.
+
     Debugging images to show the location and boundary of the detected granules. These images are saved in the 'tracking' directory in the 'detection' and 'outline' subdirectories.
     Debugging images can be configured using the 'granule_images' parameter in the config file.
     """
@@ -258,124 +340,259 @@ def process_single_image(
     output_dir = Path(output_dir)
 
     validate_args(input_image, output_dir, quiet)
+
+    hdf_save_path = fourier_save_path(input_image, output_dir, max_frame)
+    checkpoint_path = _checkpoint_path(hdf_save_path)
+    checkpoint_interval = int(config("image_processing", "checkpoint_interval"))
+    checkpoint = load_checkpoint(checkpoint_path, input_image) if resume else None
+    start_frame = 0 if checkpoint is None else checkpoint["next_frame"]
+
     try:
-        image_frames = fg.gen_opener(input_image)
+        image_frames = fg.gen_opener(input_image, start_frame)
     except Exception: 
         print(f"\n\nCould not open image file {input_image} with bioformats: unsupported or corrupted file.\n")
         return None
 
-    fourier_frames = []
+    # Decode the upcoming frames while the current one is being analysed
+    prefetch_depth = int(config("image_processing", "frame_prefetch"))
+    if prefetch_depth > 0:
+        image_frames = fg.FramePrefetcher(image_frames, depth=prefetch_depth)
+
+    # Detect the granules and draw their boundaries, these are independent between frames
+    if frame_workers > 1:
+        analysed_frames = ParallelFrameAnalyser(image_frames, analyse_frame, frame_workers, output_dir)
+    else:
+        analysed_frames = _analyse_frames(image_frames, output_dir)
+
+    # Stream the Fourier terms to file as each frame is processed
+    writer = FourierWriter(hdf_save_path)
+    fourier_records = be.FourierRecordBuffer()
+    frame_data = None
     granule_ids = None
     positions = None
+    max_order = int(config("image_processing", "max_stored_order"))
     max_distance = float(config("image_processing", "tracking_threshold"))
     granule_tracker = be._GranuleLinker(memory=10,max_distance=max_distance)
+    last_checkpoint = start_frame
+    if checkpoint is not None:
+        print(f"#{_pbar_pos+1} Resuming {input_image} from frame {start_frame}")
+        granule_tracker = checkpoint["linker"]
+        frame_data = checkpoint["frame_data"]
+        writer.resume(checkpoint["n_rows"], frame_data, checkpoint["orders"], checkpoint["im_path"])
 
     print(f"#{_pbar_pos+1} Working on image: {input_image}")
     # Add a 0.5 second sleep to ensure that the progress bars appear in the correct place.
     sleep(0.5)
     # Set up a process bar to track the frame counts.
     disable_bar = True if quiet else None
-    process_bar = tqdm.tqdm(enumerate(image_frames), disable=disable_bar, position=_pbar_pos, unit="frame", desc=f"#{_pbar_pos+1}")
+    process_bar = tqdm.tqdm(enumerate(analysed_frames, start=start_frame), disable=disable_bar, position=_pbar_pos, unit="frame", desc=f"#{_pbar_pos+1}")
 
-    for frame_num, frame in process_bar:
-        # Update the progress bar to account for the number of frames
-        if frame_num == 0 and not quiet:
-            total_frames = frame.total_frames if max_frame is None else max_frame
-            process_bar.reset(total_frames)
+    complete = False
+    try:
+        for frame_num, (frame, granule_boundries) in process_bar:
+            # Update the progress bar to account for the number of frames
+            if frame_num == start_frame and not quiet:
+                total_frames = frame.total_frames if max_frame is None else max_frame
+                process_bar.reset(total_frames)
+                process_bar.update(start_frame)
+
+            plot = _plot_frame(frame_num)
+
+            # No granules could be detected within the frame
+            if granule_boundries is None:
+                if frame_num == 0:
+                    print("No granules found on first frame, quitting")
+                    process_bar.close()
+                    raise gl.GranuleNotFoundError(
+                        f"\n\nNo granules found in {input_image}. Please check the values in the config file and try again.")
+                else:
+                    continue
+
+            # Tidy these Fourier terms per frame
+            # This is an iterative function that reuses results from the previous frames.
+        
+            try:
+                be.collect_fourier_terms(
+                    granule_boundries, frame, granule_tracker, plot, output_dir,
+                    records=fourier_records, max_order=max_order,
+                )
+            except gl.GranuleNotFoundError:
+                continue
 
-        if bool(strtobool(config("image_processing", "granule_images"))):
-            plot = frame_num % 100 == 0
-        else:
-            plot = 0
+            if frame_data is None:
+                frame_data = {
+                    "num_frames": frame.total_frames,
+                    "input_path": str(input_image.resolve()),
+                    "pixel_size": frame.pixel_size,
+                    "max_order": max_order,
+                    **image_fingerprint(input_image),
+                }
+            writer.append(fourier_records, frame_data)
+            fourier_records.clear()
+
+            # The rows are flushed to file, so we can safely restart from the next frame
+            if checkpoint_interval > 0 and writer.streaming and frame_num + 1 - last_checkpoint >= checkpoint_interval:
+                write_checkpoint(checkpoint_path, input_image, frame_num + 1, granule_tracker, writer)
+                last_checkpoint = frame_num + 1
+
+            if max_frame is not None and frame_num >= max_frame:
+                process_bar.close()
+                break
+        complete = True
+    finally:
+        # Stop the frame workers and reading thread, even if we quit early
+        analysed_frames.close()
+        if prefetch_depth > 0:
+            image_frames.close()
+        # The file is only marked as complete if we reached the end without an error
+        writer.close(complete=complete)
+        if complete:
+            checkpoint_path.unlink(missing_ok=True)
 
-        detector = gl.GranuleDetector(frame)
+    print(f"\n#{_pbar_pos+1} Fourier file save location: {hdf_save_path}\n")
 
-        # Detect the granules within the frame
-        try:
-            detector.labelGranules()
-        except gl.GranuleNotFoundError:
-            if frame_num == 0:
-                print("No granules found on first frame, quitting")
-                process_bar.close()
-                raise gl.GranuleNotFoundError(
-                    f"\n\nNo granules found in {input_image}. Please check the values in the config file and try again.")
-            else:
-                continue
 
-        # Show the heatmap of the image
-        if plot:
-            fig, axs = pt.create_axes(2)
-            detector.plot(axs[0])
-            axs[1].imshow(frame.im_data)
-            plot_save_name = (
-                output_dir
-                / f"tracking/detection/{input_image.stem}--F{frame_num:03d}.png"
-            )
-            pt.save_figure_and_trim(plot_save_name, dpi=110)
-
-        # Get the approximate boundary for each granule
-        # skip frame if there are no granules
-        boundary_method = config("image_processing", "method")
-        try:
-            granule_boundries = [
-                be.BoundaryExtraction(granule,boundary_method) for granule in detector.granules()
-            ]     
-        except gl.GranuleNotFoundError:
-            continue
+def fourier_save_path(input_image: Path, output_dir: Path, max_frame: int = None) -> Path:
+    """ Location of the Fourier file for ``input_image``. """
+    save_name = f"fourier/{Path(input_image).stem}"
+    if max_frame is not None:
+        save_name += "--DEBUG"
+    return Path(output_dir) / (save_name + ".h5")
 
-        # Tidy these Fourier terms per frame
-        # This is an iterative function that reuses results from the previous frames.
-        
-        try:
-            aggregate_terms = be.collect_fourier_terms(
-                granule_boundries, frame, granule_tracker, plot, output_dir
-            )
-            fourier_frames.append(aggregate_terms)
-        except gl.GranuleNotFoundError:
-            continue
 
-        if max_frame is not None and frame_num >= max_frame:
-            process_bar.close()
-            break
+# Values that change the speed of the analysis but not its results
+_UNFINGERPRINTED_KEYS = ("frame_prefetch", "checkpoint_interval")
 
-    # Merge all of the frame data and save
-    fourier_frames_pd = pd.concat(fourier_frames, ignore_index=True)
-    # fourier_table = consolidate_fourier_terms(fourier_frames_pd)
 
-    # Save a .csv file for debugging
-    save_name = f"fourier/{input_image.stem}"
-    if max_frame is not None:
-        save_name += "--DEBUG"
-    save_path = output_dir / (save_name + ".h5")
+def image_fingerprint(input_image: Path) -> dict:
+    """ Identify the microscope image and the configuration used to analyse it.
 
-    # Save a HDF5 file for better long-term storage with metadata
-    frame_data = {
-        "num_frames": frame.total_frames,
-        "input_path": str(input_image.resolve()),
-        "pixel_size": frame.pixel_size,
+    The image is identified by its size and modification time, rather than its contents,
+    as reading the whole of a large microscope file takes longer than some analyses.
+    """
+    return {
+        **file_fingerprint(input_image),
+        "config_hash": config_hash("image_processing", _UNFINGERPRINTED_KEYS),
     }
-    hdf_save_path = save_path.with_suffix(".h5")
-    print(f"\n#{_pbar_pos+1} Fourier file save location: {hdf_save_path}\n")
-    write_hdf(hdf_save_path, fourier_frames_pd, frame_data)
 
 
-def consolidate_fourier_terms(fourier_frame: pd.DataFrame) -> pd.DataFrame:
-    """Merge the Fourier terms into a pivot table.
+def is_up_to_date(save_path: Path, input_image: Path) -> bool:
+    """ Check if ``save_path`` is a complete Fourier file for the current ``input_image``.
+
+    Only HDF5 files are checked, files without a fingerprint are never up to date.
+    """
+    if not save_path.exists():
+        return False
+    try:
+        with h5py.File(save_path, "r") as f:
+            key = "granules" if "granules" in f else "fourier"
+            attrs = dict(f[key].attrs)
+    except (OSError, KeyError):
+        return False
+
+    if attrs.get("complete", 1) != 1 or attrs.get("version") != version.__version__:
+        return False
+    return all(attrs.get(key) == value for key, value in image_fingerprint(input_image).items())
+
+
+def _checkpoint_path(save_path: Path) -> Path:
+    """ Location of the checkpoint for the Fourier file at ``save_path``. """
+    return save_path.with_name(save_path.name + ".checkpoint")
 
-    In theory this is a much more compact way of representing the data, but for some
-    reason it is poorly behaved with pivot tables.
 
-    This would also require some conversion step to melt it back into the table.
+def write_checkpoint(checkpoint_path: Path, input_image: Path, next_frame: int, granule_tracker, writer):
+    """ Save the state needed to continue the analysis from ``next_frame``.
+
+    The checkpoint is written to a temporary file first, so an interruption while saving
+    leaves the previous checkpoint intact.
     """
-    fourier_table = fourier_frame.pivot_table(
-        values="magnitude", index=["frame", "granule_id"], columns="order"
-    )
+    checkpoint = {
+        "fingerprint": image_fingerprint(input_image),
+        "version": version.__version__,
+        "next_frame": next_frame,
+        "n_rows": writer.n_rows,
+        "linker": granule_tracker,
+        "frame_data": writer.frame_data,
+        "orders": writer.orders,
+        "im_path": writer.im_path,
+    }
+    temp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+    with open(temp_path, "wb") as file:
+        pkl.dump(checkpoint, file=file)
+    os.replace(temp_path, checkpoint_path)
 
-    trimmed_data = fourier_frame.query("order == 2").drop(columns="magnitude")
 
-    return fourier_table.merge(
-        trimmed_data, on=["frame", "granule_id"], validate="one_to_one"
-    )
+def load_checkpoint(checkpoint_path: Path, input_image: Path):
+    """ Read the checkpoint, returning None if it is missing or was made for a different analysis. """
+    if not checkpoint_path.exists():
+        warnings.warn(f"No checkpoint found for {input_image}, starting from the first frame.")
+        return None
+    with open(checkpoint_path, "rb") as file:
+        checkpoint = pkl.load(file)
+
+    save_path = checkpoint_path.with_name(checkpoint_path.name[: -len(".checkpoint")])
+    if (
+        checkpoint["fingerprint"] != image_fingerprint(input_image)
+        or checkpoint["version"] != version.__version__
+        or not save_path.exists()
+    ):
+        warnings.warn(
+            f"The checkpoint for {input_image} does not match the current image, configuration or "
+            "Fourier file, starting from the first frame."
+        )
+        return None
+    return checkpoint
+
+
+def analyse_frame(frame: fg.MicroscopeFrame, output_dir: Path):
+    """Detect the granules in a single frame and draw their boundaries.
+
+    This is the part of the analysis that is independent between frames, so it may be run
+    in a separate process (see ``frame_parallel``). The granules are linked between frames
+    afterwards by ``be.collect_fourier_terms``.
+
+    Returns a list of ``BoundaryExtraction`` objects, one per granule, with the boundary
+    already drawn. Raises ``GranuleNotFoundError`` if no granules are detected.
+    """
+    output_dir = Path(output_dir)
+    detector = gl.GranuleDetector(frame)
+
+    # Detect the granules within the frame
+    detector.labelGranules()
+
+    # Show the heatmap of the image
+    if _plot_frame(frame.frame_num):
+        fig, axs = pt.create_axes(2)
+        detector.plot(axs[0])
+        axs[1].imshow(frame.im_data)
+        plot_save_name = (
+            output_dir
+            / f"tracking/detection/{frame.im_path.stem}--F{frame.frame_num:03d}.png"
+        )
+        pt.save_figure_and_trim(plot_save_name, dpi=110)
+
+    # Get the approximate boundary for each granule, all granules are drawn together
+    boundary_method = config("image_processing", "method")
+    frame_boundaries = be.FrameBoundaryExtraction(detector.granules(), boundary_method)
+    frame_boundaries.angle_sweep(400, samples_per_pixel=15, order=4)
+    return frame_boundaries.boundaries
+
+
+def _analyse_frames(image_frames, output_dir: Path):
+    """ Serial counterpart of ``ParallelFrameAnalyser``, yielding ``(frame, result)`` pairs. """
+    for frame in image_frames:
+        try:
+            granule_boundries = analyse_frame(frame, output_dir)
+        except gl.GranuleNotFoundError:
+            granule_boundries = None
+        yield frame, granule_boundries
+
+
+def _plot_frame(frame_num: int) -> bool:
+    """ Return True if the debugging images should be saved for this frame. """
+    if bool(strtobool(config("image_processing", "granule_images"))):
+        return frame_num % 100 == 0
+    return False
 
 
 def validate_args(input_image: Path, output_dir: Path, quiet: bool = False):
@@ -386,17 +603,135 @@ def validate_args(input_image: Path, output_dir: Path, quiet: bool = False):
         raise IOError(f"Provided output_dir is not directory: {input_image}")
 
 
+class FourierWriter:
+    """Append the Fourier terms of each frame to a HDF5 file as they are produced.
+
+    The terms are stored as an appendable table under the ``granules`` key, with one row
+    per granule and frame and a ``magnitude_{order}`` column for each order. This avoids
+    repeating the granule values for every order, as in the long format table written by
+    ``write_hdf``. The frame data, configuration, version, orders and image path are
+    added as attributes when the first frame is written, along with ``complete=0``; this
+    is only set to 1 by ``close(complete=True)``.
+
+    Writing HDF5 files can fail on Apple Silicon Macs, so here the terms are kept in
+    memory and saved in the long format by ``write_hdf`` on a clean finish, which falls
+    back to a pickle.
+
+    The compression is taken from the config file unless ``compression`` is given, as a
+    dictionary of ``complib`` and ``complevel``.
+    """
+
+    def __init__(self, save_path: Path, key: str = "granules", compression: dict = None):
+        self.save_path = Path(save_path)
+        self.key = key
+        self.compression = hdf_compression() if compression is None else compression
+        self.frame_data = None
+        self.orders = None
+        self.im_path = None
+        self.n_rows = 0
+
+        self.streaming = not _is_apple_silicon()
+        self._store = None
+        self._held_frames = []
+
+    def append(self, records: be.FourierRecordBuffer, frame_data: dict):
+        """ Add the rows held in ``records``, the ``frame_data`` is only used by the first frame. """
+        if len(records) == 0:
+            return
+
+        # Continue the index between frames, as if the frames were concatenated
+        fourier_frames = records.to_wide()
+        fourier_frames = fourier_frames.set_axis(pd.RangeIndex(self.n_rows, self.n_rows + len(fourier_frames)))
+        self.n_rows += len(fourier_frames)
+        if self.frame_data is None:
+            self.frame_data = frame_data
+            self.orders = records.orders
+            self.im_path = records.im_path
+
+        if not self.streaming:
+            self._held_frames.append(fourier_frames)
+            return
+
+        if self._store is None:
+            self._create(fourier_frames)
+        else:
+            self._store.append(self.key, fourier_frames, format="table", index=False)
+        self._store.flush()
+
+    def resume(self, n_rows: int, frame_data: dict, orders, im_path: str):
+        """ Continue an unfinished file, removing any rows after the first ``n_rows``.
+
+        Rows may have been written after the last checkpoint was saved, these are written
+        again when the frames are analysed.
+        """
+        self.frame_data = frame_data
+        self.orders = orders
+        self.im_path = im_path
+        self.n_rows = n_rows
+
+        self._store = pd.HDFStore(self.save_path, mode="a", **self.compression)
+        table = self._store.get_storer(self.key).table
+        if table.nrows > n_rows:
+            table.truncate(n_rows)
+        self._store.flush()
+
+    def _create(self, fourier_frames: pd.DataFrame):
+        """ Start the file with the first frame, then add the metadata. """
+        # Strings are fixed width in the table, so leave space for longer timestamps
+        min_itemsize = {"timestamp": 40}
+        with pd.HDFStore(self.save_path, mode="w", **self.compression) as store:
+            store.append(self.key, fourier_frames, format="table", index=False, min_itemsize=min_itemsize)
+
+        with h5py.File(self.save_path, "a") as f:
+            fourier_hdf = f[self.key]
+            for key, val in self.frame_data.items():
+                fourier_hdf.attrs[key] = val
+
+            config_yaml, _ = config._aggregate_all()
+            fourier_hdf.attrs["config"] = config_yaml
+            fourier_hdf.attrs["version"] = version.__version__
+            fourier_hdf.attrs["compression"] = hdf_compression_label(self.compression)
+            fourier_hdf.attrs["layout"] = "wide"
+            fourier_hdf.attrs["orders"] = self.orders
+            fourier_hdf.attrs["im_path"] = self.im_path
+            fourier_hdf.attrs["complete"] = 0
+
+        self._store = pd.HDFStore(self.save_path, mode="a", **self.compression)
+
+    def close(self, complete: bool = False):
+        """ Close the file, marking it as complete if requested. """
+        if not self.streaming:
+            if complete and self._held_frames:
+                fourier_frames = be.wide_to_long(pd.concat(self._held_frames), self.orders, self.im_path)
+                write_hdf(self.save_path, fourier_frames, self.frame_data)
+            self._held_frames = []
+            return
+
+        if self._store is None:
+            return
+        self._store.close()
+        self._store = None
+        with h5py.File(self.save_path, "a") as f:
+            f[self.key].attrs["complete"] = int(complete)
+
+
+def _is_apple_silicon() -> bool:
+    """ Check for Apple Silicon Macs, including when running under Rosetta 2. """
+    return platform.system() == "Darwin" and "ARM64" in platform.version()
+
+
 def write_hdf(save_path: Path, fourier_frames: pd.DataFrame, frame_data):
     """ Write the data out as hdf5 files.
 
     This is more stable and portable than the previous pickle method. It also allows
     storage of metadata in a more sane manner.
     """
+    compression = hdf_compression()
     if platform.system()=="Darwin" and "ARM64" in platform.version():
         # Doing it this way will ensure we still catch Apple Silicon Macs even when using Rosetta 2.
         # The 'else' case below should catch all other platforms where writing to hdf5 should work normally.
         try:
-            fourier_frames.to_hdf(save_path, key="fourier", mode="w", complib="bzip2")
+            fourier_frames.to_hdf(save_path, key="fourier", mode="w", **compression)
 
             # Add attributes to the frames
             with h5py.File(save_path, "a") as f:
@@ -409,12 +744,13 @@ def write_hdf(save_path: Path, fourier_frames: pd.DataFrame, frame_data):
                 config_yaml, _ = config._aggregate_all()
                 fourier_hdf.attrs["config"] = config_yaml
                 fourier_hdf.attrs["version"] = version.__version__
+                fourier_hdf.attrs["compression"] = hdf_compression_label(compression)
         except:
             config_yaml, config_summary = config._aggregate_all()
             file = open(f'{str(save_path)[:-3]}.pkl', 'wb')
             pkl.dump({'fourier': fourier_frames, "frame_data": frame_data, "configuration": config_yaml, "version": version.__version__}, file=file)
     else:
-        fourier_frames.to_hdf(save_path, key="fourier", mode="w", complib="bzip2")
+        fourier_frames.to_hdf(save_path, key="fourier", mode="w", **compression)
 
         # Add attributes to the frames
         with h5py.File(save_path, "a") as f:
@@ -427,8 +763,9 @@ def write_hdf(save_path: Path, fourier_frames: pd.DataFrame, frame_data):
             config_yaml, _ = config._aggregate_all()
             fourier_hdf.attrs["config"] = config_yaml
             fourier_hdf.attrs["version"] = version.__version__
+            fourier_hdf.attrs["compression"] = hdf_compression_label(compression)
 
 if __name__ == "__main__":
     args = parse_arguments()
 
-    main(args.input, args.output, args.quiet, args.max_frame, args.cores)
+    main(args.input, args.output, args.quiet, args.max_frame, args.cores, args.force, args.resume)
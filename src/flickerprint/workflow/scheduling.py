@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+""" Share a list of files between the workers of a ``multiprocessing.Pool``.
+
+Outline
+-------
+
+The time taken to analyse a file varies greatly between files, so sending the files to
+the pool in the order that they were found means that a single large file at the end of
+the list can keep the analysis running long after the other workers have finished.
+
+``run_longest_first`` instead estimates the cost of each file up front and dispatches the
+most expensive files first, one at a time, so that the short files fill in the gaps at
+the end. The results are returned as each file finishes, along with how long it took.
+
+"""
+
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import tifffile
+
+import flickerprint.common.frame_gen as fg
+
+
+def image_cost(im_path: Path) -> float:
+    """ Estimate the relative cost of analysing a microscope image.
+
+    The cost is an estimate of the size of the pixel data in bytes, so that images of
+    every format can be compared. For TIFFs this is the uncompressed size, read from the
+    metadata, and for formats that require the javaVM to read it is the size of the file.
+    """
+    im_path = Path(im_path)
+    if not fg.requires_jvm(im_path):
+        try:
+            with tifffile.TiffFile(str(im_path)) as tif:
+                series = tif.series[0]
+                return float(np.prod(series.shape)) * np.dtype(series.dtype).itemsize
+        except Exception:
+            pass
+    return float(im_path.stat().st_size)
+
+
+def file_cost(path: Path) -> float:
+    """ Estimate the relative cost of processing a file from its size. """
+    return float(Path(path).stat().st_size)
+
+
+def run_longest_first(pool, func, tasks: list, costs: list, labels: list = None, quiet: bool = False):
+    """ Call ``func(*task)`` for each of the ``tasks`` on the ``pool``, most costly first.
+
+    Yields ``(index, result)`` pairs as the tasks finish, where ``index`` is the position
+    of the task in ``tasks``. The time taken by each task is printed unless ``quiet``.
+    """
+    if labels is None:
+        labels = [str(index) for index in range(len(tasks))]
+    order = sorted(range(len(tasks)), key=lambda index: costs[index], reverse=True)
+    jobs = [(index, func, tasks[index]) for index in order]
+
+    for index, result, duration in pool.imap_unordered(_timed_call, jobs, chunksize=1):
+        if not quiet:
+            print(f"\nFinished {labels[index]} in {_format_duration(duration)}")
+        yield index, result
+
+
+def _timed_call(job):
+    """ Run a single task in the worker, returning how long it took. """
+    index, func, args = job
+    start = perf_counter()
+    result = func(*args)
+    return index, result, perf_counter() - start
+
+
+def _format_duration(duration: float) -> str:
+    minutes, seconds = divmod(duration, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02.0f}s"
+    if minutes:
+        return f"{minutes}m {seconds:02.0f}s"
+    return f"{seconds:.1f}s"
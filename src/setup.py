@@ -292,6 +292,7 @@ setup(name='flickerprint',
                         "wget",
                         "strictyaml>=1.7.3",
                         "tables>=3.9.1",
+                        "tifffile",
                         "opencv-python>=4.10.0.84",
                         "exifread>=3.0.0",
                         "tensorflow>=2.16.2",
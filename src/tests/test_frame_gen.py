@@ -0,0 +1,73 @@
+""" Tests for reading microscope frames and their metadata. """
+
+import threading
+
+import numpy as np
+import pytest
+
+from flickerprint.common import frame_gen as fg
+
+
+def test_prefetcher_yields_every_frame():
+    frames = fg.FramePrefetcher(iter(range(10)), depth=2)
+    assert list(frames) == list(range(10))
+
+
+def test_unreadable_file_raises_through_prefetcher(tmp_path):
+    im_path = tmp_path / "corrupt.tif"
+    im_path.write_bytes(b"not a tiff file" * 100)
+
+    frames = fg.FramePrefetcher(fg.gen_opener(im_path), depth=2)
+    with pytest.raises(ValueError, match="Could not open image file"):
+        next(frames)
+    # The error ends the frames, rather than leaving the caller waiting for more
+    with pytest.raises(StopIteration):
+        next(frames)
+
+
+def test_close_releases_waiting_consumer():
+    release = threading.Event()
+
+    def blocked_frames():
+        yield 0
+        release.wait()
+        yield 1
+
+    frames = fg.FramePrefetcher(blocked_frames(), depth=1)
+    assert next(frames) == 0
+    # Close from another thread while the caller is waiting for the next frame
+    closer = threading.Timer(0.2, frames.close)
+    closer.start()
+    with pytest.raises(StopIteration):
+        next(frames)
+    release.set()
+    closer.join(timeout=5)
+    assert not closer.is_alive()
+
+
+def _ome_xml(acquisition_date: str) -> str:
+    """ A minimal OME-XML header with two frames, 0.5 s apart. """
+    return f"""<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">
+      <Image ID="Image:0">
+        <AcquisitionDate>{acquisition_date}</AcquisitionDate>
+        <Pixels ID="Pixels:0" SizeT="2" PhysicalSizeX="0.1" PhysicalSizeY="0.1">
+          <Plane TheT="0" TheZ="0" TheC="0" DeltaT="0.0"/>
+          <Plane TheT="1" TheZ="0" TheC="0" DeltaT="0.5"/>
+        </Pixels>
+      </Image>
+    </OME>"""
+
+
+@pytest.mark.parametrize(
+    "acquisition_date", ["2021-03-04T10:20:30", "2021-03-04T10:20:30.1234567Z", "2021-03-04T10:20:30+01:00"]
+)
+def test_ome_timestamps(acquisition_date):
+    pixel_size, time_stamps, actual_timestamp = fg._getOMEmetadata(_ome_xml(acquisition_date))
+    assert pixel_size == pytest.approx(0.1)
+    assert actual_timestamp
+    assert time_stamps[0] >= np.datetime64("2021-03-04T10:20:30", "ms")
+    assert time_stamps[1] - time_stamps[0] == np.timedelta64(500, "ms")
+
+
+def test_unreadable_ome_date_skips_timestamps():
+    assert fg._getOMEmetadata(_ome_xml("4th March 2021")) == (pytest.approx(0.1), None, False)
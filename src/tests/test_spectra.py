@@ -0,0 +1,48 @@
+""" Tests for fitting the surface tension only model to flicker spectra. """
+
+import numpy as np
+import pytest
+
+from flickerprint.fluctuation.spectra import SpectrumFitterBuilder, SpectrumFitterBuilder_ST_Only
+
+
+@pytest.fixture
+def spectra():
+    """ Surface tension only spectra, σ between 10^-3 and 10^5 with log-normal noise. """
+    rng = np.random.default_rng(0)
+    builder = SpectrumFitterBuilder_ST_Only(q_max=15)
+    sigma_bar = 10 ** rng.uniform(-3, 5, 50)
+    spectra = builder.get_spectra(sigma_bar[:, None, None])
+    return spectra * 10 ** rng.normal(0, 0.3, spectra.shape)
+
+
+def test_exact_fit_matches_minimiser(spectra):
+    builder = SpectrumFitterBuilder_ST_Only(q_max=15)
+    exact = builder.exact_fit(spectra)
+    numeric = [builder.minimiser(*builder.create_fitting_function(spectrum)) for spectrum in spectra]
+
+    for key in ["sigma_ST_bar", "sigma_ST_bar_err", "fitting_error_ST"]:
+        expected = np.array([result[key] for result in numeric])
+        np.testing.assert_allclose(exact[key], expected, rtol=1e-6, err_msg=key)
+
+
+def test_exact_fit_derived_values(spectra):
+    """ ``sigma_st`` and ``fitting_diff``, as calculated in ``process_fourier_file``. """
+    builder = SpectrumFitterBuilder_ST_Only(q_max=15)
+    full_builder = SpectrumFitterBuilder(q_max=15)
+    exact = builder.exact_fit(spectra)
+    numeric = [builder.minimiser(*builder.create_fitting_function(spectrum)) for spectrum in spectra]
+    fitting_error = full_builder.batch_minimiser(spectra)["fitting_error"]
+
+    # A granule with a radius of 0.5 μm at 37 °C
+    radius_factor = 1 / (0.5e-6) ** 2 * 1.380649e-23 * 310.15
+    sigma_st = exact["sigma_ST_bar"] * radius_factor
+    expected_sigma_st = np.array([result["sigma_ST_bar"] for result in numeric]) * radius_factor
+    np.testing.assert_allclose(sigma_st, expected_sigma_st, rtol=1e-6)
+
+    fitting_diff = exact["fitting_error_ST"] - fitting_error
+    expected_diff = np.array([result["fitting_error_ST"] for result in numeric]) - fitting_error
+    np.testing.assert_allclose(fitting_diff, expected_diff, rtol=1e-6, atol=1e-10)
+    # The surface tension only model is the limit of large σ, so fits at most slightly better
+    # than σ and κ, where the search in σ stops at 10^7
+    assert np.all(fitting_diff >= -1e-4 * fitting_error)